@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark loading, grounding and solving the bundled events.
+
+Each event (and each team with a 'team-<TEAM>.tsv' roster) is run in a fresh process with caches disabled. Phase
+timings, ground program size and final costs are written to a JSON results file. Events without .lp programs are only
+loaded. Pass --baseline to compare against an earlier results file; the exit status is 1 if anything regressed, so the
+script can gate changes to the domain or team programs. Run it with and without --warm-start and compare the two results
+files to see how a greedy starting point changes the time to the first and the best model. With --coarse-precision, the
+coarse solve is timed separately and its schedule seeds the full precision solve; add the two to compare against a
+baseline without it.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import glob
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+
+import clingo
+import clorm
+from tabulate import tabulate
+
+from solve import make_ctrl, add_programs, instance_facts, warm_start_arguments, warm_start, solve_coarse, \
+    seed_from_schedule
+from relay_scheduler.domain import Objective, make_standard_func_ctx
+from relay_scheduler.legpack import PACK_FILENAME, event_legs_path, load_legs
+from relay_scheduler.warmstart import add_warm_start
+
+TIMINGS = ["load", "coarse", "parse", "ground", "warm_start", "first_model", "best_model", "solve"]
+SIZES = ["atoms", "rules", "vars", "constraints"]
+
+
+def find_instances(events):
+    """
+    :return: (event, team) pairs. Team is None for events scheduled as a single group.
+    """
+    instances = []
+    for event in events:
+        teams = sorted(os.path.basename(path)[len("team-"):-len(".tsv")] for path in glob.glob(f"{event}/team-*.tsv"))
+        instances.extend((event, team) for team in teams or [None])
+    return instances
+
+
+def instance_name(event, team):
+    return f"{event}/{team}" if team else event
+
+
+def run_instance(event, team, args):
+    """
+    Load, ground and solve one instance, timing each phase. Runs in its own process so memory use and
+    solver state don't leak between instances.
+    """
+    solve_args = argparse.Namespace(event=event, team=team, distance_precision=args.distance_precision,
+                                    duration_precision=args.duration_precision, const=args.const, jobs=args.jobs,
+                                    load_jobs=1, no_leg_cache=True, no_ground_cache=True,
+                                    commute_matrix="full", commute_radius=None, geojson_tolerance=None,
+                                    warm_start=args.warm_start, coarse_precision=args.coarse_precision,
+                                    coarse_time_limit=args.coarse_time_limit)
+    result = {}
+    start = time.perf_counter()
+    # Facts are built in memory. Writing facts.lpx would leave the event directory with the benchmark's settings.
+    legs_path = event_legs_path(event)
+    bundle = load_legs(legs_path, cache=False) if legs_path is not None else None
+    to_add = instance_facts(solve_args, bundle)
+    result["load"] = time.perf_counter() - start
+    if not glob.glob(f"{event}/*.lp"):
+        result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return result
+
+    schedule = None
+    if args.coarse_precision is not None:
+        start = time.perf_counter()
+        schedule = solve_coarse(solve_args)
+        result["coarse"] = time.perf_counter() - start
+
+    ctrl = make_ctrl(solve_args, [f"--seed={args.seed}"] + warm_start_arguments(solve_args))
+    # Stop at the first optimal model instead of enumerating all of them
+    ctrl.configuration.solve.opt_mode = "opt"
+    start = time.perf_counter()
+    add_programs(ctrl, solve_args, cache=False)
+    result["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ctrl.add_facts(to_add)
+    calls = collections.Counter()
+    ctrl.ground([("base", [])] + ([(team, [])] if team else []), context=make_standard_func_ctx(calls))
+    result["ground"] = time.perf_counter() - start
+    result["external_calls"] = sum(calls.values())
+
+    if args.warm_start or schedule is not None:
+        start = time.perf_counter()
+        if schedule is not None:
+            add_warm_start(ctrl, *schedule)
+        else:
+            warm_start(ctrl, solve_args)
+        result["warm_start"] = time.perf_counter() - start
+
+    objectives = clorm.unify([Objective], [atom.symbol for atom in ctrl.symbolic_atoms.by_signature("objective", 2)])
+    objectives_by_priority = dict(objectives.query(Objective).select(Objective.priority, Objective.name).all())
+    best = {}
+    start = time.perf_counter()
+
+    def on_model(model):
+        elapsed = time.perf_counter() - start
+        best.setdefault("first_model", elapsed)
+        best["best_model"] = elapsed
+        best["costs"] = {objectives_by_priority[priority]: cost for priority, cost in zip(model.priority, model.cost)}
+
+    seed = []
+    if schedule is not None:
+        # Leave the solver in opt mode, as set above, rather than enumerating every schedule as good as the seed
+        seed = seed_from_schedule(ctrl, schedule, on_model, lambda: time.perf_counter() - start >= args.time_limit,
+                                  mode="opt")
+    exhausted = False
+    if seed is not None:
+        with ctrl.solve(on_model=on_model, async_=True) as handle:
+            if not handle.wait(max(args.time_limit - (time.perf_counter() - start), 0)):
+                handle.cancel()
+            exhausted = handle.get().exhausted
+    result["solve"] = time.perf_counter() - start
+    result.update(best)
+    result["optimal"] = bool(exhausted and best)
+
+    problem = ctrl.statistics["problem"]
+    result["atoms"] = int(problem["lp"]["atoms"])
+    result["rules"] = int(problem["lp"]["rules"])
+    result["vars"] = int(problem["generator"]["vars"])
+    result["constraints"] = int(problem["generator"]["constraints"])
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def run_repeated(event, team, args):
+    runs = []
+    for _ in range(args.repeat):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            runs.append(executor.submit(run_instance, event, team, args).result())
+    # Median timings smooth out noise. Sizes and costs come from the last run; grounding is deterministic and the
+    # seed is fixed.
+    result = dict(runs[-1])
+    for phase in TIMINGS:
+        values = [run[phase] for run in runs if phase in run]
+        if len(values) == len(runs):
+            result[phase] = statistics.median(values)
+    return result
+
+
+def compare(baseline, current, tolerance, min_delta):
+    """
+    :return: (table rows, number of regressions). Timings regress when they grow by more than `tolerance` (relative)
+        and `min_delta` seconds; ground sizes when they grow by more than `tolerance`; costs when they're
+        lexicographically worse.
+    """
+    rows = []
+    regressions = 0
+    for name in sorted(set(baseline) | set(current)):
+        old, new = baseline.get(name), current.get(name)
+        if old is None or new is None:
+            status = "new" if old is None else "REGRESSION"
+            regressions += old is not None
+            rows.append([name, "", "", "", "", f"{status} (missing {'baseline' if old is None else 'result'})"])
+            continue
+        for metric in TIMINGS + SIZES + ["costs"]:
+            if metric not in old and metric not in new:
+                continue
+            before, after = old.get(metric), new.get(metric)
+            status = ""
+            if before is None or after is None:
+                status = "REGRESSION" if after is None else ""
+                change = ""
+                if metric in TIMINGS and after is not None:
+                    after = f"{after:.2f}"
+            elif metric == "costs":
+                if list(before.values()) == list(after.values()):
+                    change = ""
+                else:
+                    worse = list(after.values()) > list(before.values())
+                    change = "worse" if worse else "better"
+                    status = "REGRESSION" if worse else "improved"
+                before, after = list(before.values()), list(after.values())
+            else:
+                ratio = after / before if before else float("inf") if after else 1.0
+                change = f"{(ratio - 1) * 100:+.1f}%"
+                grew = ratio > 1 + tolerance and (metric in SIZES or after - before > min_delta)
+                shrank = ratio < 1 - tolerance and (metric in SIZES or before - after > min_delta)
+                status = "REGRESSION" if grew else "improved" if shrank else ""
+                if metric in TIMINGS:
+                    before, after = f"{before:.2f}", f"{after:.2f}"
+            regressions += status == "REGRESSION"
+            rows.append([name, metric, before, after, change, status])
+    return rows, regressions
+
+
+def main(args):
+    events = args.events or sorted(os.path.dirname(path) for path in glob.glob("*/")
+                                   if glob.glob(f"{path}*.lp") or os.path.isdir(f"{path}legs")
+                                   or os.path.exists(f"{path}{PACK_FILENAME}"))
+    results = {}
+    for event, team in find_instances(events):
+        name = instance_name(event, team)
+        print("Benchmarking", name, file=sys.stderr)
+        try:
+            results[name] = run_repeated(event, team, args)
+        except Exception as e:
+            print(f"{name} failed: {e}", file=sys.stderr)
+            results[name] = {"error": str(e)}
+
+    print(tabulate([[name] + [f"{result[phase]:.2f}" if phase in result else "" for phase in TIMINGS]
+                    + [result.get("atoms", ""), result.get("optimal", ""), result.get("error", "")]
+                    for name, result in results.items()],
+                   headers=["Instance"] + TIMINGS + ["atoms", "optimal", "error"]))
+
+    out = {"created": datetime.datetime.now().isoformat(),
+           "clingo": clingo.__version__,
+           "python": platform.python_version(),
+           "machine": platform.machine(),
+           "settings": {"time_limit": args.time_limit, "jobs": args.jobs, "seed": args.seed, "repeat": args.repeat,
+                        "const": args.const, "warm_start": args.warm_start,
+                        "coarse_precision": args.coarse_precision, "coarse_time_limit": args.coarse_time_limit,
+                        "distance_precision": args.distance_precision,
+                        "duration_precision": args.duration_precision},
+           "instances": results}
+    with open(args.output, "w") as f:
+        json.dump(out, f, indent=2)
+    print("Results written to", args.output)
+
+    failed = any("error" in result for result in results.values())
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["settings"] != out["settings"]:
+            print("Warning: baseline was recorded with different settings", baseline["settings"], file=sys.stderr)
+        # Only hold the events we ran to the baseline
+        baseline = {name: result for name, result in baseline["instances"].items() if name.split("/")[0] in events}
+        rows, regressions = compare(baseline, results, args.tolerance, args.min_delta)
+        print(tabulate(rows, headers=["Instance", "Metric", "Baseline", "Current", "Change", ""]))
+        print(f"{regressions} regression(s) against {args.baseline}")
+        failed = failed or regressions > 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("events", nargs="*", help="Event directories to benchmark (default: every directory with .lp files or a legs bundle)")
+    parser.add_argument("-o", "--output", default="benchmark-results.json", help="Where to write the results")
+    parser.add_argument("--baseline", help="Results file from an earlier run to compare against")
+    parser.add_argument("--time-limit", type=float, default=60, help="Seconds to solve each instance for")
+    parser.add_argument("--repeat", type=int, default=1, help="Run each instance this many times and report median timings")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative growth in a timing or ground size that counts as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.5, help="Ignore timing changes smaller than this many seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Solver seed")
+    parser.add_argument("--distance-precision", default=2.0, type=float, help="Number of decimal places of fixed precision to convert distance terms to")
+    parser.add_argument("--duration-precision", default=0.0, type=float, help="Number of decimal places of fixed precision to convert distance terms to")
+    parser.add_argument("-c", "--const", action="append", default=[], metavar="NAME=VALUE", help="Override a #const in the programs, e.g. '-c range_encoding=compact'. Can be repeated.")
+    parser.add_argument("--warm-start", nargs="?", const="sign", choices=["sign", "level"], help="Steer the solver towards a greedy schedule, as with solve.py --warm-start")
+    parser.add_argument("--coarse-precision", type=float, metavar="DECIMALS", help="Seed the solve from a schedule solved with distances to this many decimal places, as with solve.py --coarse-precision")
+    parser.add_argument("--coarse-time-limit", type=float, default=30, metavar="SECONDS", help="Seconds to spend on the coarse solve with --coarse-precision")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of cores to use for solving. Timings are most stable with 1.")
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import time
+
+from relay_scheduler.legpack import compile_legs, load_packed_legs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a directory of GPX legs into a single memory-mappable file that loads in milliseconds")
+    parser.add_argument("legs_dir", help="Path to directory containing GPX files")
+    parser.add_argument("-o", "--output", help="Output file (default: 'legs.pack' next to the legs directory)")
+    parser.add_argument("--load-jobs", type=int, default=1,
+                       help="Number of processes to use for parsing GPX legs")
+    parser.add_argument("--no-leg-cache", action="store_true",
+                       help="Parse every GPX leg instead of reusing the shared cache of parsed legs")
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.legs_dir):
+        print(f"Error: {args.legs_dir} is not a directory")
+        return 1
+
+    path = compile_legs(args.legs_dir, args.output, workers=args.load_jobs, cache=not args.no_leg_cache)
+    start = time.perf_counter()
+    legs, _ = load_packed_legs(path)
+    elapsed = time.perf_counter() - start
+    points = sum(len(leg["coordinates"]) for leg in legs.values())
+    print(f"Packed {len(legs)} legs ({points} track points) into {path}, {os.path.getsize(path) / 1024:.0f} KiB. "
+          f"Opens in {elapsed * 1000:.1f}ms.")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
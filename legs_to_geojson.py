@@ -2,37 +2,66 @@
 
 import argparse
 import os
+import sys
 
-from relay_scheduler.legs import load_from_legs_bundle, relay_to_geojson, dump_geojson_with_compact_geometry
+from relay_scheduler.legpack import load_legs
+from relay_scheduler.legs import iter_relay_features, write_geojson_features, track_significance
+
+
+def lod_path(output, tolerance):
+    root, ext = os.path.splitext(output)
+    return f"{root}.{tolerance:g}m{ext or '.geojson'}"
 
 
 def main():
     parser = argparse.ArgumentParser(description="Convert GPX legs directory to GeoJSON")
-    parser.add_argument("legs_dir", help="Path to directory containing GPX files")
+    parser.add_argument("legs_dir", help="Path to directory containing GPX files, or a legs.pack compiled from one")
     parser.add_argument("-o", "--output", help="Output GeoJSON file (default: stdout)")
     parser.add_argument("--exclude-exchanges", nargs="+", type=int, metavar="ID", 
                        help="Exclude exchanges by ID (and any legs touching them)")
+    parser.add_argument("--simplify", type=float, metavar="METERS",
+                       help="Drop track points while keeping each leg within this many meters of the GPX track")
+    parser.add_argument("--lod", nargs="+", type=float, default=[], metavar="METERS",
+                       help="Also write a simplified copy of the output for each tolerance, e.g. 'relay.10m.geojson' for 10")
+    parser.add_argument("--load-jobs", type=int, default=1,
+                       help="Number of processes to use for parsing GPX legs")
+    parser.add_argument("--no-leg-cache", action="store_true",
+                       help="Parse every GPX leg instead of reusing the shared cache of parsed legs")
     
     args = parser.parse_args()
     
-    if not os.path.isdir(args.legs_dir):
-        print(f"Error: {args.legs_dir} is not a directory")
+    if not os.path.exists(args.legs_dir):
+        print(f"Error: {args.legs_dir} does not exist")
+        return 1
+    if args.lod and not args.output:
+        print("Error: --lod needs --output to name the files after")
         return 1
     
-    legs, exchanges_data = load_from_legs_bundle(args.legs_dir)
-    geojson = relay_to_geojson(legs, exchanges_data=exchanges_data, 
-                              exclude_exchanges=args.exclude_exchanges)
-    
+    legs, exchanges_data = load_legs(args.legs_dir, workers=args.load_jobs, cache=not args.no_leg_cache)
+
+    significance = None
+    if args.lod:
+        # Rank each leg's points once, down to the finest tolerance, and cut every level of detail from that
+        tolerances = args.lod + ([args.simplify] if args.simplify is not None else [])
+        significance = {pair: track_significance(leg["coordinates"], min(tolerances)) for pair, leg in legs.items()}
+
+    def features(tolerance):
+        return iter_relay_features(legs, exchanges_data=exchanges_data, exclude_exchanges=args.exclude_exchanges,
+                                   tolerance=tolerance, significance=significance)
+
     if args.output:
         with open(args.output, 'w') as f:
-            dump_geojson_with_compact_geometry(geojson, f)
+            write_geojson_features(features(args.simplify), f)
         print(f"GeoJSON written to {args.output}")
+        for tolerance in args.lod:
+            with open(lod_path(args.output, tolerance), 'w') as f:
+                write_geojson_features(features(tolerance), f)
+            print(f"GeoJSON simplified to {tolerance:g}m written to {lod_path(args.output, tolerance)}")
     else:
-        import json
-        print(json.dumps(geojson, indent=2))
+        write_geojson_features(features(args.simplify), sys.stdout)
     
     return 0
 
 
 if __name__ == "__main__":
-    exit(main())
\ No newline at end of file
+    exit(main())
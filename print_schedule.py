@@ -1,88 +1,210 @@
 #!/usr/bin/env python3
 
 """
-Pretty print a schedule from a solution JSON file or raw Clingo output.
+Pretty print a schedule from a solution JSON file, a solution store or raw Clingo output.
 """
 
 import argparse
+import heapq
 import json
 import pathlib
 import re
 
-from clorm import clingo
+import clorm
+import xxhash
+from clingo import parse_term
+from tabulate import tabulate
 
 from relay_scheduler.domain import LegCoverage, Leg, LegDistK, DistanceK, PreferredPaceK, CommuteDistanceK, LegAscent, \
     Ascent, PreferredEndExchange, Descent, LegDescent, PreferredDistanceK, Objective, LeaderOn, ExchangeName, Run, \
     LegPaceK
-from relay_scheduler.schedule import assignments_to_str, schedule_to_str, extract_schedule, extract_assignments
-
-
-def split_solve_output(solve_output: pathlib.Path):
-    with open(solve_output) as f:
-        answers = []
-        costs = []
-        lines = f.readlines()
-        i = 3
-        while i < len(lines):
-            line = lines[i]
-            if line.startswith("Answer"):
-                answers.append(lines[i + 1])
-                numbers = lines[i + 2].split(":")[1].strip().split(" ")
-                costs.append(list(map(int, numbers)))
-                i += 3
-                continue
-            i += 1
-    return answers, costs
+from relay_scheduler.schedule import assignments_to_str, schedule_to_str, extract_schedule, extract_assignments, \
+    EXCHANGE_OVERHEAD
+from relay_scheduler.store import SolutionStore
+from relay_scheduler.timing import simulate_start_offsets, arrival_percentiles, arrivals_to_str
+
+# An atom is everything up to the next space, except inside strings, which may contain spaces and escaped quotes
+ATOM_PATTERN = re.compile(r'(?:"(?:[^"\\]|\\.)*"|[^\s"])+')
+
+
+class ClingoOutputReader:
+    """
+    Reads answers from Clingo's text output (`--outf=0`) one at a time, so logs of any size can be scanned without
+    holding more than the current answer. `optimum_found` is set once the reader has seen Clingo report the optimum.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.optimum_found = False
+
+    def __iter__(self):
+        """
+        :return: Generator of (answer number, atoms text, costs or None if there's no optimization)
+        """
+        number = atoms = None
+        for line in self.f:
+            if line.startswith("Answer:"):
+                if atoms is not None:
+                    yield number, atoms, None
+                number = int(line.split()[1])
+                atoms = next(self.f, "")
+            elif line.startswith("Optimization:") and atoms is not None:
+                yield number, atoms, list(map(int, line.split(":")[1].split()))
+                atoms = None
+            elif line.startswith("OPTIMUM FOUND"):
+                self.optimum_found = True
+        if atoms is not None:
+            yield number, atoms, None
+
+
+def parse_atoms(atoms_text):
+    """
+    Parse a line of atoms printed by Clingo, with or without `--out-atomf=%s.`, into symbols
+    """
+    return [parse_term(atom[:-1] if atom.endswith(".") else atom) for atom in ATOM_PATTERN.findall(atoms_text)]
 
 
 def extract_schedule_from_answer_set(answer_set):
+    symbols = parse_atoms(answer_set)
+    # pull distancePrecision(<float>) and durationPrecision(<float>) from answer_set
+    distance_precision = 2.0
+    duration_precision = 0.0
+    for symbol in symbols:
+        if symbol.name == "distancePrecision" and len(symbol.arguments) == 1:
+            distance_precision = float(symbol.arguments[0].string)
+        elif symbol.name == "durationPrecision" and len(symbol.arguments) == 1:
+            duration_precision = float(symbol.arguments[0].string)
+    unifier = [LegCoverage, LegPaceK(duration_precision), Run, LegDistK(distance_precision), ExchangeName,
+               Leg,
+               LegDistK(distance_precision), LegAscent, LegDescent, Objective, LeaderOn,
+               DistanceK(distance_precision), Ascent, Descent, PreferredDistanceK(distance_precision),
+               PreferredPaceK(duration_precision), PreferredEndExchange,
+               CommuteDistanceK(distance_precision)]
+    facts = clorm.unify(unifier, symbols)
+    return extract_schedule(facts, distance_precision, duration_precision), extract_assignments(facts,  distance_precision, duration_precision)
 
-    # pull distancePrecsion(<float>) and durationPrecision(<float>) from answer_set
-    distance_precision = re.search(r'distancePrecision\(\"(\d+\.\d+)\"\)', answer_set)
-    duration_precision = re.search(r'durationPrecision\(\"(\d+\.\d+)\"\)', answer_set)
-    if not distance_precision:
-        distance_precision = 2.0
-    else:
-        distance_precision = float(distance_precision.group(1))
-    if not duration_precision:
-        duration_precision = 0.0
+
+def select_answers(reader, args):
+    """
+    Pick the answers to print as they stream past, keeping only the atoms of answers that might be selected.
+    :return: Generator of (answer number, atoms text, costs)
+    """
+    if args.last:
+        last = None
+        for answer in reader:
+            last = answer
+        if last is not None:
+            yield last
+    elif args.best is not None:
+        # Max-heap on cost (then on how late the answer came) of the best answers so far
+        best = []
+        seen = set()
+        for i, (number, atoms, costs) in enumerate(reader):
+            # Clingo prints optimal models twice when enumerating them
+            digest = xxhash.xxh64_digest(atoms.encode())
+            if digest in seen:
+                continue
+            key = [-cost for cost in costs or []]
+            if len(best) < args.best:
+                heapq.heappush(best, (key, -i, digest, number, atoms, costs))
+                seen.add(digest)
+            elif (key, -i) > best[0][:2]:
+                seen.discard(heapq.heappushpop(best, (key, -i, digest, number, atoms, costs))[2])
+                seen.add(digest)
+        for *_, number, atoms, costs in sorted(best, reverse=True):
+            yield number, atoms, costs
+    elif args.optimal_only:
+        optimal = {}
+        optimal_costs = None
+        for number, atoms, costs in reader:
+            costs = costs or []
+            if optimal_costs is None or costs < optimal_costs:
+                optimal, optimal_costs = {}, costs
+            if costs == optimal_costs:
+                optimal.setdefault(xxhash.xxh64_digest(atoms.encode()), (number, atoms, costs))
+        if not reader.optimum_found:
+            print("Clingo didn't prove any answer optimal")
+            return
+        yield from optimal.values()
     else:
-        duration_precision = float(duration_precision.group(1))
-    clingo_control = clingo.Control(
-        unifier=[LegCoverage, LegPaceK(duration_precision), Run, LegDistK(distance_precision), ExchangeName,
-                 Leg,
-                 LegDistK(distance_precision), LegAscent, LegDescent, Objective, LeaderOn,
-                 DistanceK(distance_precision), Ascent, Descent, PreferredDistanceK(distance_precision),
-                 PreferredPaceK(duration_precision), PreferredEndExchange,
-                 CommuteDistanceK(distance_precision)])
-    clingo_control.add(answer_set)
-    clingo_control.ground([("base", [])])
-    facts = clingo_control.unifier.unify([symbol.symbol for symbol in clingo_control.symbolic_atoms])
-    return extract_schedule(facts, distance_precision, duration_precision), extract_assignments(facts,  distance_precision, duration_precision)
+        yield from reader
+
+
+def select_stored(store, args):
+    """
+    :return: Summaries of the stored solutions to print
+    """
+    if args.last:
+        return store.summaries()[-1:]
+    if args.best is not None:
+        return store.best(args.best)
+    return store.summaries(optimal_only=args.optimal_only, hash_prefix=args.hash)
+
+
+def print_arrivals(schedule, assignments, args):
+    if args.simulate:
+        offsets = simulate_start_offsets(schedule, assignments, args.simulate, pace_sd=args.pace_sd,
+                                         exchange_sd=args.exchange_sd, exchange_overhead=args.exchange_overhead,
+                                         ascent_factor=args.ascent_factor)
+        print(arrivals_to_str(schedule, arrival_percentiles(offsets)))
+
+
+def print_solution(solution, args):
+    print(assignments_to_str(solution["assignments"]))
+    print(schedule_to_str(solution["schedule"], exchange_overhead=args.exchange_overhead, ascent_factor=args.ascent_factor))
+    print_arrivals(solution["schedule"], solution["assignments"], args)
+    print(solution["costs"].items())
 
 
 def main(args):
     if args.solution_path.suffix == ".txt":
-        answer_sets, costs = split_solve_output(args.solution_path)
-        for answer_set, cost in zip(answer_sets, costs):
-            schedule, assignments = extract_schedule_from_answer_set(answer_set)
-            print(assignments_to_str(assignments))
-            print(schedule_to_str(schedule, exchange_overhead=args.exchange_overhead, climbing_adjustment=args.climbing_adjustment))
+        with open(args.solution_path) as f:
+            for number, answer_set, costs in select_answers(ClingoOutputReader(f), args):
+                schedule, assignments = extract_schedule_from_answer_set(answer_set)
+                print(f"Answer {number}:")
+                print(assignments_to_str(assignments))
+                print(schedule_to_str(schedule, exchange_overhead=args.exchange_overhead, ascent_factor=args.ascent_factor))
+                print_arrivals(schedule, assignments, args)
+                print(costs)
 
     elif args.solution_path.suffix == ".json":
         with open(args.solution_path) as f:
             solution = json.load(f)
-        costs = solution["costs"].items()
-        schedule, assignments = solution["schedule"], solution["assignments"]
-        print(assignments_to_str(assignments))
-        print(schedule_to_str(schedule, exchange_overhead=args.exchange_overhead, ascent_factor=args.ascent_factor))
-        print(costs)
+        print_solution(solution, args)
+
+    elif args.solution_path.suffix == ".sqlite":
+        store = SolutionStore(args.solution_path)
+        summaries = select_stored(store, args)
+        if args.list:
+            print(tabulate([[s["id"], s["hash"], s["name"], s["optimal"], *s["costs"].values(), s["compute_time"]]
+                            for s in summaries],
+                           headers=["id", "hash", "name", "optimal", *(summaries[0]["costs"] if summaries else []),
+                                    "time (s)"]))
+        for summary in [] if args.list else summaries:
+            print(f"Solution {summary['id']} ({summary['name']}, {summary['hash']}):")
+            if args.atoms:
+                print(store.atoms(summary["id"]) or "Atoms weren't stored", end="")
+            else:
+                print_solution(store.solution(summary["id"]), args)
+        store.close()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("solution_path", type=pathlib.Path)
-    parser.add_argument("--exchange-overhead", type=int, default=60, help="Time in seconds to add at each exchange")
+    parser.add_argument("--exchange-overhead", type=int, default=EXCHANGE_OVERHEAD, help="Time in seconds to add at each exchange")
     parser.add_argument("--ascent-factor", type=int, default=10, help="Seconds per mile added for each 100ft of elevation gain on a leg")
+    parser.add_argument("--simulate", type=int, default=0, metavar="RACES", help="Simulate this many races and print the percentiles of when the team reaches each exchange")
+    parser.add_argument("--pace-sd", type=float, default=0.04, help="Spread of each runner's pace on the day in simulated races, as the standard deviation of its log")
+    parser.add_argument("--exchange-sd", type=float, default=0.5, help="Coefficient of variation of the exchange overhead in simulated races")
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("--last", action="store_true", help="Only print the last answer in Clingo output, or the last stored solution")
+    selection.add_argument("--best", type=int, metavar="N", help="Only print the N lowest cost answers in Clingo output or the store, best first")
+    selection.add_argument("--optimal-only", action="store_true", help="Only print answers (or stored solutions) that Clingo proved optimal")
+    selection.add_argument("--hash", metavar="PREFIX", help="Only print stored solutions whose hash starts with PREFIX")
+    parser.add_argument("--list", action="store_true", help="List the selected stored solutions with their costs instead of printing them")
+    parser.add_argument("--atoms", action="store_true", help="Print the selected stored solutions' atoms instead of their schedules")
     args = parser.parse_args()
+    if (args.hash or args.list or args.atoms) and args.solution_path.suffix != ".sqlite":
+        parser.error("--hash, --list and --atoms only apply to a solution store (.sqlite)")
     main(args)
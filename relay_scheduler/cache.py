@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+
+import xxhash
+
+
+def default_cache_dir():
+    """
+    Cache root shared by every event directory. Override with `RELAY_SCHEDULER_CACHE`.
+    """
+    if "RELAY_SCHEDULER_CACHE" in os.environ:
+        return os.environ["RELAY_SCHEDULER_CACHE"]
+    return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "relay-scheduler")
+
+
+def digest_bytes(data):
+    return xxhash.xxh64_hexdigest(data)
+
+
+def digest_file(path):
+    with open(path, "rb") as f:
+        return digest_bytes(f.read())
+
+
+def write_atomically(path, write):
+    """
+    Call `write` with a binary file handle, then move the result into place so concurrent readers (or other
+    processes writing the same entry) never see a partial file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def touch(path):
+    """
+    Mark an entry as recently used so eviction keeps it.
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict(directory, max_bytes):
+    """
+    Delete the least recently used entries in `directory` until it holds at most `max_bytes`.
+    """
+    if not os.path.isdir(directory):
+        return
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+# Bump when the way facts or derived artifacts are generated changes, so old manifests stop matching
+MANIFEST_VERSION = 2
+
+
+def build_manifest(paths, **params):
+    """
+    Describe a set of input files (by content hash) and the parameters used to process them.
+    """
+    return {"version": MANIFEST_VERSION,
+            "files": {str(path): digest_file(path) for path in sorted(paths)},
+            "params": params}
+
+
+def read_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(path, manifest):
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
@@ -13,16 +13,29 @@ def duration(val, precision):
     return kPrecision(sum(x * int(t) for x, t in zip([1, 60, 3600], reversed(val.split(":")))), precision)
 
 
-def make_standard_func_ctx():
+def make_standard_func_ctx(calls=None):
     """
-    Functions that are callable using `@` from ASP files.
+    Functions that are callable using `@` from ASP files. Calls with constant arguments are folded away by
+    `FloatPaceTransformer`; the rest are memoized, since grounding calls them with the same arguments over and over.
+    :param calls: Counter of the calls clingo makes to each function, to see what they cost during grounding
     """
     cb = ContextBuilder()
 
-    cb.register_name("min", IntegerField, IntegerField, IntegerField, min)
-    cb.register_name("max", IntegerField, IntegerField, IntegerField, max)
-    cb.register_name("k", IntegerField, StringField, IntegerField, kPrecision)
-    cb.register_name("duration", StringField, StringField, IntegerField, kPrecision)
+    def external(name, func):
+        func = cache(func)
+        if calls is None:
+            return func
+
+        def counted(*args):
+            calls[name] += 1
+            return func(*args)
+
+        return counted
+
+    cb.register_name("min", IntegerField, IntegerField, IntegerField, external("min", min))
+    cb.register_name("max", IntegerField, IntegerField, IntegerField, external("max", max))
+    cb.register_name("k", IntegerField, StringField, IntegerField, external("k", kPrecision))
+    cb.register_name("duration", StringField, StringField, IntegerField, external("duration", duration))
 
     return cb.make_context()
 
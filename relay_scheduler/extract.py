@@ -0,0 +1,148 @@
+from collections import defaultdict
+
+import clorm
+import xxhash
+
+from relay_scheduler.domain import ExchangeName, Leg, Ascent, Descent, PreferredEndExchange, Objective, Run, \
+    LeaderOn, DistanceK, CommuteDistanceK, LegDistK, PreferredDistanceK, PreferredPaceK, LegPaceK
+from relay_scheduler.schedule import find_all_paths
+
+
+class ModelExtractor:
+    """
+    Builds schedules from models without unifying every atom with clorm.
+
+    Everything but the runners' assignments is fixed once the instance is ground, so the instance data (exchanges,
+    distances, ascents, the commute matrix, preferences) is read once into dicts. Each model then only needs to say
+    which of the `run/2`, `leaderOn/2` and `legPace/2` atoms it contains. Produces the same schedule and assignments
+    as `extract_schedule` and `extract_assignments`.
+    """
+
+    def __init__(self, symbolic_atoms, distance_precision, duration_precision):
+        static = [ExchangeName, Leg, Ascent, Descent, PreferredEndExchange, Objective, DistanceK(distance_precision),
+                  CommuteDistanceK(distance_precision), LegDistK(distance_precision),
+                  PreferredDistanceK(distance_precision), PreferredPaceK(duration_precision)]
+        symbols = []
+        for predicate in static:
+            for atom in symbolic_atoms.by_signature(predicate.meta.name, predicate.meta.arity):
+                if not atom.is_fact:
+                    raise ValueError(f"{atom.symbol} depends on the solution, so it can't be read before solving")
+                symbols.append(atom.symbol)
+        facts = clorm.FactBase(clorm.unify(static, symbols))
+        Distance, CommuteDistance, LegDist = DistanceK(distance_precision), CommuteDistanceK(distance_precision), \
+            LegDistK(distance_precision)
+        PreferredDistance, PreferredPace = PreferredDistanceK(distance_precision), PreferredPaceK(duration_precision)
+
+        self.exchange_names = dict(facts.query(ExchangeName).select(ExchangeName.id, ExchangeName.name).all())
+        self.legs = {leg.id: (leg.start_id, leg.end_id) for leg in facts.query(Leg).all()}
+        self.leg_dist = dict(facts.query(LegDist).select(LegDist.leg, LegDist.dist).all())
+        self.distance = {(d.start_id, d.end_id): d.dist for d in facts.query(Distance).all()}
+        self.commute_distance = {(d.start_id, d.end_id): d.dist for d in facts.query(CommuteDistance).all()}
+        self.ascent = {(a.start_id, a.end_id): a.ascent for a in facts.query(Ascent).all()}
+        self.descent = {(d.start_id, d.end_id): d.descent for d in facts.query(Descent).all()}
+        self.preferred_pace = {}
+        for name, pace in facts.query(PreferredPace).select(PreferredPace.name, PreferredPace.pace).all():
+            self.preferred_pace.setdefault(name, pace)
+        self.preferred_distance = dict(facts.query(PreferredDistance)
+                                       .select(PreferredDistance.name, PreferredDistance.distance).all())
+        self.preferred_end = dict(facts.query(PreferredEndExchange)
+                                  .select(PreferredEndExchange.name, PreferredEndExchange.exchange_id).all())
+        self.objectives_by_priority = dict(facts.query(Objective).select(Objective.priority, Objective.name).all())
+
+        # Solver literal, symbol and decoded fields of every atom a model can pick, in symbol order so that the atoms
+        # a model contains come out sorted
+        self.literals = []
+        self.symbols = []
+        self.atoms = []
+        for predicate in [Run, LeaderOn, LegPaceK(duration_precision)]:
+            candidates = sorted(symbolic_atoms.by_signature(predicate.meta.name, predicate.meta.arity),
+                                key=lambda atom: atom.symbol)
+            unified = clorm.unify([predicate], [atom.symbol for atom in candidates], ordered=True)
+            if len(unified) != len(candidates):
+                raise ValueError(f"Couldn't unify every {predicate.meta.name}/{predicate.meta.arity} atom")
+            for atom, fact in zip(candidates, unified):
+                self.literals.append(atom.literal)
+                self.symbols.append(atom.symbol)
+                self.atoms.append((predicate.meta.name, fact[0], fact[1]))
+
+    def true_atoms(self, model):
+        """
+        Cheap enough to call from `on_model`
+        :return: Indexes of the schedule atoms in the model
+        """
+        is_true = model.is_true
+        return [i for i, literal in enumerate(self.literals) if is_true(literal)]
+
+    def extract(self, true_atoms):
+        """
+        :param true_atoms: From `true_atoms`
+        :return: (schedule, assignments, hash of the schedule atoms, schedule atoms)
+        """
+        runners_on_legs = defaultdict(list)
+        leader_on_leg = {}
+        leg_pace = {}
+        runner_legs = defaultdict(list)
+        symbols = []
+        for i in true_atoms:
+            name, first, second = self.atoms[i]
+            if name == "run":
+                runners_on_legs[second].append(first)
+                runner_legs[first].append(second)
+            elif name == "leaderOn":
+                leader_on_leg.setdefault(second, first)
+            else:
+                leg_pace[first] = second
+            symbols.append(self.symbols[i])
+        if len(runners_on_legs) == 0:
+            raise ValueError("No runners found in the model. Did you forget to load the participants?")
+
+        schedule = []
+        for leg_num in range(len(self.legs)):
+            exchange_start, exchange_end = self.legs[leg_num]
+            details = {}
+            details["leg"] = leg_num
+            details["start_exchange_name"] = self.exchange_names[exchange_start]
+            details["end_exchange_name"] = self.exchange_names[exchange_end]
+            details["start_exchange"] = exchange_start
+            details["end_exchange"] = exchange_end
+            details["runners"] = runners_on_legs[leg_num]
+            if leg_num in leader_on_leg:
+                details["leader"] = leader_on_leg[leg_num]
+            details["pace_mi"] = leg_pace[leg_num]
+            details["distance_mi"] = self.leg_dist[leg_num]
+            details["ascent_ft"] = self.ascent[(exchange_start, exchange_end)]
+            details["descent_ft"] = self.descent[(exchange_start, exchange_end)]
+            schedule.append(details)
+
+        assignments = []
+        for runner in sorted(runner_legs):
+            legs = sorted(runner_legs[runner])
+            exchange_pairs = [self.legs[leg] for leg in legs]
+            segments = find_all_paths(exchange_pairs)
+            paces = [leg_pace[leg] for leg in reversed(legs)]
+            distances = [self.distance[pair] for pair in exchange_pairs]
+            ascents = [self.ascent[pair] for pair in exchange_pairs]
+            descents = [self.descent[pair] for pair in exchange_pairs]
+            details = {}
+            details["runner"] = runner
+            details["legs"] = legs
+            details["exchanges"] = [[self.exchange_names[exchange] for exchange in segment] for segment in segments]
+            details["paces"] = paces
+            details["total_distance_mi"] = sum(distances)
+            details["distance_mi"] = distances
+            details["total_ascent_ft"] = sum(ascents)
+            details["ascent_ft"] = ascents
+            details["total_descent_ft"] = sum(descents)
+            details["descent_ft"] = descents
+            details["loss_distance"] = sum(distances) - self.preferred_distance[runner]
+            # If no entry, user has no preference
+            details["loss_end"] = 0
+            if runner in self.preferred_end:
+                # Missing if left out of the commute matrix (--commute-matrix preferred, with the preference declared
+                # in a program). --commute-radius only caps distances. The commute-pref objective counts those as 0 too.
+                details["loss_end"] = self.commute_distance.get((segments[-1][-1], self.preferred_end[runner]), 0)
+            details["loss_pace"] = [pace - self.preferred_pace[runner] for pace in paces]
+            assignments.append(details)
+
+        atoms_hash = xxhash.xxh64_hexdigest("".join(f"{symbol}.\n" for symbol in symbols).encode())
+        return schedule, assignments, atoms_hash, symbols
@@ -0,0 +1,121 @@
+import json
+import os
+import struct
+from glob import glob
+
+import numpy as np
+
+from relay_scheduler.cache import write_atomically
+from relay_scheduler.legs import load_from_legs_bundle
+
+# A packed legs file is:
+#   8 byte magic, little-endian uint64 length of the metadata, UTF-8 JSON metadata,
+#   zero padding to a multiple of DATA_ALIGNMENT, then float64 lat, lon and ele columns of every leg's track points.
+# The metadata holds each leg's offset and length into the columns along with everything else `load_leg` returns,
+# plus the exchange metadata.
+PACK_MAGIC = b"RLYLEGS\x00"
+PACK_VERSION = 1
+PACK_FILENAME = "legs.pack"
+DATA_ALIGNMENT = 64
+_HEADER = struct.Struct("<8sQ")
+
+
+def pack_legs(legs, exchanges_data, path):
+    """
+    Write legs (as returned by `load_from_legs_bundle`) to a packed legs file
+    """
+    records = []
+    offset = 0
+    for leg in legs.values():
+        record = {k: v for k, v in leg.items() if k != "coordinates"}
+        record["offset"] = offset
+        record["length"] = len(leg["coordinates"])
+        offset += len(leg["coordinates"])
+        records.append(record)
+    columns = np.empty((3, offset), dtype="<f8")
+    for record, leg in zip(records, legs.values()):
+        columns[:, record["offset"]:record["offset"] + record["length"]] = np.asarray(leg["coordinates"]).T
+    # JSON object keys must be strings
+    exchanges = None if exchanges_data is None else [exchange for _, exchange in sorted(exchanges_data.items())]
+    metadata = json.dumps({"version": PACK_VERSION, "points": offset, "legs": records,
+                           "exchanges": exchanges}).encode()
+    padding = -(_HEADER.size + len(metadata)) % DATA_ALIGNMENT
+
+    def write(f):
+        f.write(_HEADER.pack(PACK_MAGIC, len(metadata)))
+        f.write(metadata)
+        f.write(b"\0" * padding)
+        f.write(columns.tobytes())
+
+    write_atomically(os.path.abspath(path), write)
+
+
+def compile_legs(legs_dir, path=None, workers=1, cache=True):
+    """
+    Pack a directory of GPX legs (and its exchanges.geojson) into a single file, by default `legs.pack` next to it
+    :return: Path of the packed file
+    """
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.normpath(legs_dir)), PACK_FILENAME)
+    legs, exchanges_data = load_from_legs_bundle(legs_dir, workers=workers, cache=cache)
+    pack_legs(legs, exchanges_data, path)
+    return path
+
+
+def load_packed_legs(path):
+    """
+    Open a packed legs file. Only the metadata is read up front: each leg's `coordinates` is an (N, 3) view into a
+    read-only memory map of the columns, so track points are only read from disk once they're used.
+    :return: Legs keyed by `(start_id, end_id)` and exchange metadata, like `load_from_legs_bundle`
+    """
+    with open(path, "rb") as f:
+        magic, metadata_length = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != PACK_MAGIC:
+            raise ValueError(f"{path} is not a packed legs file")
+        metadata = json.loads(f.read(metadata_length))
+    if metadata["version"] != PACK_VERSION:
+        raise ValueError(f"{path} was packed in format version {metadata['version']}. Compile it again.")
+    data_offset = _HEADER.size + metadata_length
+    data_offset += -data_offset % DATA_ALIGNMENT
+    columns = None
+    if metadata["points"]:
+        columns = np.memmap(path, dtype="<f8", mode="r", offset=data_offset, shape=(3, metadata["points"]))
+
+    legs = {}
+    for record in metadata["legs"]:
+        offset, length = record.pop("offset"), record.pop("length")
+        if columns is None:
+            record["coordinates"] = np.empty((0, 3))
+        else:
+            record["coordinates"] = columns[:, offset:offset + length].T
+        legs[(record["start_exchange"], record["end_exchange"])] = record
+    exchanges_data = None
+    if metadata["exchanges"] is not None:
+        exchanges_data = {exchange["id"]: exchange for exchange in metadata["exchanges"]}
+    return legs, exchanges_data
+
+
+def load_legs(path, workers=1, cache=True):
+    """
+    Load legs from a directory of GPX files or a packed legs file
+    """
+    if os.path.isdir(path):
+        return load_from_legs_bundle(path, workers=workers, cache=cache)
+    return load_packed_legs(path)
+
+
+def event_legs_path(event):
+    """
+    Where to load an event's legs from: `legs.pack` if it's been compiled and is newer than every file in the `legs`
+    directory, otherwise the directory. None if the event has neither.
+    """
+    legs_dir = os.path.join(event, "legs")
+    pack_path = os.path.join(event, PACK_FILENAME)
+    if os.path.exists(pack_path):
+        sources = glob(os.path.join(legs_dir, "*.gpx")) + glob(os.path.join(legs_dir, "exchanges.geojson"))
+        if not sources or os.path.getmtime(pack_path) >= max(os.path.getmtime(source) for source in sources):
+            return pack_path
+        print(f"{pack_path} is older than {legs_dir}, loading the directory instead. Compile it again to use it.")
+    if os.path.isdir(legs_dir):
+        return legs_dir
+    return None
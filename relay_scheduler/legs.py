@@ -1,115 +1,269 @@
+import io
+import itertools
 import json
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from glob import glob
 
 import clingo
 import clorm
-import lxml
+import numpy as np
 from lxml import etree
 import os
 import haversine
 
+from relay_scheduler.cache import default_cache_dir, digest_bytes, evict, touch, write_atomically
 from relay_scheduler.domain import DistanceK, Ascent, ExchangeName, CommuteDistanceK, Descent
 
 
-def load_from_legs_bundle(dir_path):
-    legs = {}
-
-    # Load rich exchange metadata if exchanges.geojson exists
-    exchanges_data = None
+GPX_NAMESPACE = "http://www.topografix.com/GPX/1/1"
+FEET_PER_METER = 3.28084
+EARTH_RADIUS_M = 6371008.8
+# Bump when parsing or measurement changes so stale cache entries are ignored
+LEG_CACHE_VERSION = 1
+LEG_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_TRKPT = f"{{{GPX_NAMESPACE}}}trkpt"
+_WPT = f"{{{GPX_NAMESPACE}}}wpt"
+_ELE = f"{{{GPX_NAMESPACE}}}ele"
+_NAME = f"{{{GPX_NAMESPACE}}}name"
+_DESC = f"{{{GPX_NAMESPACE}}}desc"
+_CMT = f"{{{GPX_NAMESPACE}}}cmt"
+_SYM = f"{{{GPX_NAMESPACE}}}sym"
+_KEYWORDS = f"{{{GPX_NAMESPACE}}}keywords"
+_TIME = f"{{{GPX_NAMESPACE}}}time"
+_METADATA = f"{{{GPX_NAMESPACE}}}metadata"
+
+
+def load_exchanges(dir_path):
+    """
+    Load rich exchange metadata from `exchanges.geojson` in the legs directory, if it exists.
+    """
     exchanges_file = os.path.join(dir_path, "exchanges.geojson")
-    if os.path.exists(exchanges_file):
-        with open(exchanges_file) as f:
-            exchanges_geojson = json.load(f)
-            exchanges_data = {
-                feature["properties"]["id"]: {
-                    **feature["properties"],
-                    "coordinates": feature["geometry"]["coordinates"]
-                }
-                for feature in exchanges_geojson["features"]
-            }
-
-    for gpx_filename in glob(os.path.join(dir_path, "*.gpx")):
-        # Filenames are assumed to be of the form "<start_id>-<end_id>.gpx"
-        start_id, end_id = os.path.splitext(os.path.basename(gpx_filename))[0].split("-")
-        with open(gpx_filename) as f:
-            gpx_data = lxml.etree.parse(f)
-        points = gpx_data.xpath("//gpx:trkpt", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})
-        coordinates = []
-        for point in points:
-            elevation = point.xpath("gpx:ele", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})[0].text
-            coordinates.append((float(point.attrib["lat"]), float(point.attrib["lon"]), float(elevation)))
-
-        waypoints = gpx_data.xpath("//gpx:wpt", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})
-        pois = []
-        for waypoint in waypoints:
+    if not os.path.exists(exchanges_file):
+        return None
+    with open(exchanges_file) as f:
+        exchanges_geojson = json.load(f)
+    return {
+        feature["properties"]["id"]: {
+            **feature["properties"],
+            "coordinates": feature["geometry"]["coordinates"]
+        }
+        for feature in exchanges_geojson["features"]
+    }
+
+
+def parse_gpx(gpx_file):
+    """
+    Read a GPX file in a single streaming pass.
+    :return: Track points as an (N, 3) array of (lat, lon, ele), plus the first name, description and keywords
+        in the document, the metadata time, and the waypoints as POI dicts.
+    """
+    points = array("d")
+    pois = []
+    title = description = keywords = time = None
+    for _, elem in etree.iterparse(gpx_file, events=("end",),
+                                   tag=(_TRKPT, _WPT, _NAME, _DESC, _KEYWORDS, _TIME)):
+        tag = elem.tag
+        if tag == _TRKPT:
+            points.append(float(elem.get("lat")))
+            points.append(float(elem.get("lon")))
+            points.append(float(elem.findtext(_ELE)))
+            # Drop points we've already consumed so memory stays flat on dense tracks
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        elif tag == _WPT:
             poi = {
-                'lat': float(waypoint.attrib["lat"]),
-                'lon': float(waypoint.attrib["lon"])
+                'lat': float(elem.get("lat")),
+                'lon': float(elem.get("lon"))
             }
-
-            elevation_elem = waypoint.xpath("gpx:ele", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})
-            if elevation_elem:
-                poi['elevation'] = float(elevation_elem[0].text)
-
-            name_elem = waypoint.xpath("gpx:name", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})
-            if name_elem:
-                poi['name'] = name_elem[0].text
-
-            comment_elem = waypoint.xpath("gpx:cmt", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})
-            if comment_elem:
-                poi['comment'] = comment_elem[0].text
-
-            desc_elem = waypoint.xpath("gpx:desc", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})
-            if desc_elem:
-                poi['description'] = desc_elem[0].text
-
-            sym_elem = waypoint.xpath("gpx:sym", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})
-            if sym_elem:
-                poi['symbol'] = sym_elem[0].text
-
+            elevation = elem.findtext(_ELE)
+            if elevation is not None:
+                poi['elevation'] = float(elevation)
+            for child_tag, key in ((_NAME, 'name'), (_CMT, 'comment'), (_DESC, 'description'), (_SYM, 'symbol')):
+                child = elem.find(child_tag)
+                if child is not None:
+                    poi[key] = child.text
             pois.append(poi)
-        title = gpx_data.xpath("//gpx:name", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})[0].text
-        keywords_tag = gpx_data.xpath("//gpx:keywords", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})
-        attributes = []
-        if keywords_tag:
-            attributes = keywords_tag[0].text.split(",")
+        elif tag == _NAME:
+            if title is None:
+                title = elem.text
+        elif tag == _DESC:
+            if description is None:
+                description = elem.text
+        elif tag == _KEYWORDS:
+            if keywords is None:
+                keywords = elem.text
+        elif tag == _TIME:
+            if time is None and elem.getparent().tag == _METADATA:
+                time = elem.text
+    coordinates = np.frombuffer(points, dtype=np.float64).reshape(-1, 3)
+    return coordinates, title, description, keywords, time, pois
+
+
+def measure_track(coordinates):
+    """
+    Vectorized distance (mi), ascent (ft) and descent (ft) of an (N, 3) array of (lat, lon, ele) points.
+    """
+    if len(coordinates) < 2:
+        return 0.0, 0.0, 0.0
+    climbs = np.diff(coordinates[:, 2])
+    ascent = climbs[climbs > 0].sum() * FEET_PER_METER
+    descent = -climbs[climbs < 0].sum() * FEET_PER_METER
+    distance = haversine.haversine_vector(coordinates[:-1, :2], coordinates[1:, :2], unit=haversine.Unit.MILES).sum()
+    return float(distance), float(ascent), float(descent)
+
+
+def _read_cached_leg(path):
+    with np.load(path, allow_pickle=False) as entry:
+        return json.loads(entry["record"].tobytes()), entry["coordinates"]
+
+
+def _write_cached_leg(path, record, coordinates):
+    encoded_record = np.frombuffer(json.dumps(record).encode(), dtype=np.uint8)
+    write_atomically(path, lambda f: np.savez_compressed(f, record=encoded_record, coordinates=coordinates))
+
+
+def load_leg(gpx_filename, cache_dir=None):
+    """
+    Parse and measure a single leg. If `cache_dir` is given, results are stored there keyed by the hash of the
+    file's bytes, so identical legs (even across event directories) are only parsed once.
+    """
+    # Filenames are assumed to be of the form "<start_id>-<end_id>.gpx"
+    start_id, end_id = os.path.splitext(os.path.basename(gpx_filename))[0].split("-")
+    with open(gpx_filename, "rb") as f:
+        gpx_bytes = f.read()
+
+    record = coordinates = cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f"{digest_bytes(gpx_bytes)}-v{LEG_CACHE_VERSION}.npz")
+        if os.path.exists(cache_path):
+            try:
+                record, coordinates = _read_cached_leg(cache_path)
+                touch(cache_path)
+            except (OSError, ValueError, KeyError):
+                # Evicted or damaged underneath us. Parse it again
+                record = None
+
+    if record is None:
+        coordinates, title, description, keywords, time, pois = parse_gpx(io.BytesIO(gpx_bytes))
         start_name, end_name = title.split(" to ")
-        ascent = sum(max(0, c2[2] - c1[2]) for c1, c2 in zip(coordinates[:-1], coordinates[1:])) * 3.28084
-        descent = sum(max(0, c1[2] - c2[2]) for c1, c2 in zip(coordinates[:-1], coordinates[1:])) * 3.28084
-        distance = sum(haversine.haversine(c1[:2], c2[:2], unit=haversine.Unit.MILES) for c1, c2 in zip(coordinates[:-1], coordinates[1:]))
-        description = gpx_data.xpath("//gpx:desc", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})
-        if description:
-            description = description[0].text
-        else:
-            description = ""
-
-        time_elem = gpx_data.xpath("//gpx:metadata/gpx:time", namespaces={"gpx": "http://www.topografix.com/GPX/1/1"})
-        time = None
-        if time_elem:
-            time = time_elem[0].text
-        leg = {'distance_mi': distance,
-               'ascent_ft': ascent,
-               'descent_ft': descent,
-               'start_exchange': int(start_id),
-                'end_exchange': int(end_id),
-               'notes': description,
-               'start_name': start_name,
-                'end_name': end_name,
-               'coordinates': coordinates,
-               'attributes': attributes,
-               'pois': pois,
-               'time': time
-               }
-        legs[(int(start_id), int(end_id))] = leg
+        attributes = []
+        if keywords:
+            attributes = keywords.split(",")
+        distance, ascent, descent = measure_track(coordinates)
+        record = {'distance_mi': distance,
+                  'ascent_ft': ascent,
+                  'descent_ft': descent,
+                  'notes': description or "",
+                  'start_name': start_name,
+                  'end_name': end_name,
+                  'attributes': attributes,
+                  'pois': pois,
+                  'time': time
+                  }
+        if cache_path:
+            _write_cached_leg(cache_path, record, coordinates)
+
+    return {'distance_mi': record['distance_mi'],
+            'ascent_ft': record['ascent_ft'],
+            'descent_ft': record['descent_ft'],
+            'start_exchange': int(start_id),
+            'end_exchange': int(end_id),
+            'notes': record['notes'],
+            'start_name': record['start_name'],
+            'end_name': record['end_name'],
+            'coordinates': coordinates,
+            'attributes': record['attributes'],
+            'pois': record['pois'],
+            'time': record['time']
+            }
 
-    return legs, exchanges_data
 
+def load_from_legs_bundle(dir_path, workers=1, cache=True):
+    """
+    Load every `<start_id>-<end_id>.gpx` leg in a directory.
+    :param workers: Number of processes to parse legs with. `None` uses every core
+    :param cache: Reuse previously parsed legs from the shared on-disk cache, and store newly parsed ones
+    :return: Legs keyed by `(start_id, end_id)`, and exchange metadata from `exchanges.geojson` (or None). Each
+        leg's `coordinates` is an (N, 3) NumPy array of (lat, lon, ele) rows.
+    """
+    exchanges_data = load_exchanges(dir_path)
+    gpx_filenames = glob(os.path.join(dir_path, "*.gpx"))
+    cache_dir = os.path.join(default_cache_dir(), "legs") if cache else None
+    if (workers is None or workers > 1) and len(gpx_filenames) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            loaded = list(pool.map(partial(load_leg, cache_dir=cache_dir), gpx_filenames))
+    else:
+        loaded = [load_leg(gpx_filename, cache_dir) for gpx_filename in gpx_filenames]
+    if cache_dir:
+        evict(cache_dir, LEG_CACHE_MAX_BYTES)
+
+    # Merge in a fixed order so results don't depend on directory listing or worker scheduling
+    legs = {}
+    for leg in sorted(loaded, key=lambda leg: (leg["start_exchange"], leg["end_exchange"])):
+        legs[(leg["start_exchange"], leg["end_exchange"])] = leg
 
-def flip_lat_long(lat_long_ele_point):
-    return (lat_long_ele_point[1], lat_long_ele_point[0], lat_long_ele_point[2])
+    return legs, exchanges_data
 
 
-def relay_to_geojson(legs, sequences=None, exchanges_data=None, exclude_exchanges=None):
+def track_significance(coordinates, min_tolerance=0.0):
+    """
+    Douglas-Peucker significance of each point of an (N, 3) array of (lat, lon, ele) track points: the largest
+    tolerance (m) at which simplifying the track keeps the point. The endpoints are always kept. Significance is
+    computed once for all tolerances, so any number of levels of detail can be cut from it.
+    :param min_tolerance: Don't bother ranking points that only matter below this tolerance. They get 0.
+    """
+    significance = np.zeros(len(coordinates))
+    if len(coordinates) == 0:
+        return significance
+    significance[[0, -1]] = np.inf
+    # Project onto a plane around the track. Legs are short enough that the distortion doesn't matter.
+    latitudes, longitudes = np.radians(coordinates[:, 0]), np.radians(coordinates[:, 1])
+    x = longitudes * np.cos(latitudes.mean()) * EARTH_RADIUS_M
+    y = latitudes * EARTH_RADIUS_M
+    spans = [(0, len(coordinates) - 1, np.inf)]
+    while spans:
+        start, end, parent_significance = spans.pop()
+        if end - start < 2:
+            continue
+        # Distance from each point in the span to the segment joining its ends
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length_squared = dx * dx + dy * dy
+        t = np.clip((px * dx + py * dy) / length_squared, 0, 1) if length_squared else 0
+        distances = np.hypot(px - t * dx, py - t * dy)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] <= min_tolerance:
+            continue
+        # A point can't outlast the point that split its span
+        split_significance = min(distances[farthest], parent_significance)
+        split = start + 1 + farthest
+        significance[split] = split_significance
+        spans.append((start, split, split_significance))
+        spans.append((split, end, split_significance))
+    return significance
+
+
+def simplify_track(coordinates, tolerance):
+    """
+    Drop track points (Douglas-Peucker) while keeping the line within `tolerance` meters of the original
+    """
+    return coordinates[track_significance(coordinates, tolerance) > tolerance]
+
+
+def iter_relay_features(legs, sequences=None, exchanges_data=None, exclude_exchanges=None, tolerance=None,
+                        significance=None):
+    """
+    Generate the GeoJSON features for a relay: each leg (in sequence order) followed by its POIs, then the
+    exchanges. Legs are converted as they're generated, so only one leg's coordinates are copied at a time.
+    :param sequences: {(start_id, end_id): [leg numbers]} for the legs to include. Defaults to every leg, in order
+    :param tolerance: Simplify leg tracks to within this many meters. Keeps every point by default
+    :param significance: {(start_id, end_id): `track_significance` of the leg's track} to simplify with, so it isn't
+        computed again for every tolerance. Computed as needed by default
+    """
     if exclude_exchanges is None:
         exclude_exchanges = set()
     else:
@@ -121,26 +275,40 @@ def relay_to_geojson(legs, sequences=None, exchanges_data=None, exclude_exchange
                         if pair[0] not in exclude_exchanges and pair[1] not in exclude_exchanges}
         sequences = {pair: [i] for i, pair in enumerate(reversed(sorted(filtered_legs.keys())))}
 
-    features = []
-    for leg in legs.values():
-        # Skip legs that touch excluded exchanges
-        if leg["start_exchange"] in exclude_exchanges or leg["end_exchange"] in exclude_exchanges:
-            continue
+    # Skip legs that touch excluded exchanges, and legs we must not be running
+    running = [leg for leg in legs.values()
+               if leg["start_exchange"] not in exclude_exchanges and leg["end_exchange"] not in exclude_exchanges
+               and (leg["start_exchange"], leg["end_exchange"]) in sequences]
+    running.sort(key=lambda leg: sequences[(leg["start_exchange"], leg["end_exchange"])][0])
+
+    # Add a unique ID to each feature, but preserve exchange IDs
+    feature_ids = itertools.count()
+
+    def with_id(feature):
+        # Don't overwrite exchange IDs - they're meaningful station codes
+        if "id" not in feature["properties"]:
+            feature["properties"]["id"] = next(feature_ids)
+        return feature
+
+    exchanges = {}
+    for leg in running:
         leg_without_coordinates = {k: v for k, v in leg.items() if k not in ["coordinates", "pois"]}
         # Float props likely have too much precision. Round them to 2 decimal places
         for k, v in leg_without_coordinates.items():
             if isinstance(v, float):
                 leg_without_coordinates[k] = round(v, 2)
         exchange_pair = (leg["start_exchange"], leg["end_exchange"])
-        if exchange_pair not in sequences:
-            # We must not be running this leg
-            continue
         leg_without_coordinates["sequence"] = sequences[exchange_pair]
-        leg_feature = {"type": "Feature",
+        coordinates = leg["coordinates"]
+        if tolerance is not None and significance is not None:
+            coordinates = coordinates[significance[exchange_pair] > tolerance]
+        elif tolerance is not None:
+            coordinates = simplify_track(coordinates, tolerance)
+        coordinates = coordinates[:, [1, 0, 2]].tolist()
+        yield with_id({"type": "Feature",
                        "properties": leg_without_coordinates,
                        "geometry": {"type": "LineString",
-                                    "coordinates": list(map(flip_lat_long, leg["coordinates"]))}}
-        features.append(leg_feature)
+                                    "coordinates": coordinates}})
 
         # Add POIs for this leg
         for poi in leg.get("pois", []):
@@ -155,64 +323,47 @@ def relay_to_geojson(legs, sequences=None, exchanges_data=None, exclude_exchange
             if "elevation" in poi_properties and isinstance(poi_properties["elevation"], float):
                 poi_properties["elevation"] = round(poi_properties["elevation"], 2)
 
-            poi_feature = {"type": "Feature",
-                          "properties": poi_properties,
-                          "geometry": {"type": "Point",
-                                      "coordinates": [poi["lon"], poi["lat"]]}}
-            features.append(poi_feature)
-    features = sorted(features, key=lambda x: x["properties"].get("sequence", x["properties"].get("leg_sequence", [999]))[0])
+            yield with_id({"type": "Feature",
+                           "properties": poi_properties,
+                           "geometry": {"type": "Point",
+                                        "coordinates": [poi["lon"], poi["lat"]]}})
 
-    # Pull exchanges implied by the legs
-    exchanges = {}
-    for feature in features:
-        leg = feature["properties"]
-        coordinates = feature["geometry"]["coordinates"]
-        # Only process LineString features (legs), not Points (POIs or exchanges)
-        if feature["geometry"]["type"] == "LineString" and "start_exchange" in leg:
-            start_id = leg["start_exchange"]
-            end_id = leg["end_exchange"]
-
-            # Use rich exchange data if available, otherwise use inferred data
-            if exchanges_data and start_id in exchanges_data:
-                exchanges[start_id] = exchanges_data[start_id].copy()
+        # Pull exchanges implied by the legs. Use rich exchange data if available, otherwise use inferred data
+        for exchange_id, name, point in ((exchange_pair[0], leg["start_name"], coordinates[0]),
+                                         (exchange_pair[1], leg["end_name"], coordinates[-1])):
+            if exchanges_data and exchange_id in exchanges_data:
+                exchanges[exchange_id] = exchanges_data[exchange_id].copy()
             else:
-                exchanges[start_id] = {"id": start_id,
-                                     "name": leg["start_name"],
-                                     "coordinates": coordinates[0]}
+                exchanges[exchange_id] = {"id": exchange_id, "name": name, "coordinates": point}
 
-            if exchanges_data and end_id in exchanges_data:
-                exchanges[end_id] = exchanges_data[end_id].copy()
-            else:
-                exchanges[end_id] = {"id": end_id,
-                                   "name": leg["end_name"],
-                                   "coordinates": coordinates[-1]}
+    for id, exchange in sorted(exchanges.items()):
+        if id in exclude_exchanges:
+            continue
+        yield with_id({"type": "Feature",
+                       "properties": {k: v for k, v in exchange.items() if k != "coordinates"},
+                       "geometry": {"type": "Point",
+                                    "coordinates": exchange["coordinates"]}})
 
-    # Filter out excluded exchanges
-    for exchange_id in list(exchanges.keys()):
-        if exchange_id in exclude_exchanges:
-            del exchanges[exchange_id]
 
-    for id, exchange in sorted(exchanges.items()):
-        exchange_feature = {"type": "Feature",
-                            "properties": {k: v for k, v in exchange.items() if k != "coordinates"},
-                            "geometry": {"type": "Point",
-                                         "coordinates": exchange["coordinates"]}}
-        features.append(exchange_feature)
-    # Add a unique ID to each feature, but preserve exchange IDs
-    feature_id = 0
-    for feature in features:
-        # Don't overwrite exchange IDs - they're meaningful station codes
-        if "id" not in feature["properties"]:
-            feature["properties"]["id"] = feature_id
-            feature_id += 1
+def relay_to_geojson(legs, sequences=None, exchanges_data=None, exclude_exchanges=None, tolerance=None):
     return {"type": "FeatureCollection",
-            "features": features}
+            "features": list(iter_relay_features(legs, sequences, exchanges_data, exclude_exchanges, tolerance))}
 
 
-def dump_geojson_with_compact_geometry(geojson, f):
+def write_geojson_features(features, f):
+    """
+    Stream features to `f` as a FeatureCollection, writing each as soon as it's generated. Properties are indented
+    for reading diffs; geometry is written compactly.
+    """
     f.write('{"type":"FeatureCollection","features":[\n')
 
-    for i, feature in enumerate(geojson['features']):
+    first = True
+    for feature in features:
+        # Handle commas between features
+        if not first:
+            f.write(',\n')
+        first = False
+
         # Create a copy of the feature without the geometry
         feature_copy = feature.copy()
         geometry = feature_copy.pop('geometry')
@@ -224,16 +375,56 @@ def dump_geojson_with_compact_geometry(geojson, f):
         compact_geometry = json.dumps(geometry, separators=(',', ':'))
         f.write(f', "geometry":{compact_geometry}\n}}')
 
-        # Handle commas between features
-        if i < len(geojson['features']) - 1:
-            f.write(',\n')
-        else:
-            f.write('\n')
-
+    if not first:
+        f.write('\n')
     f.write(']}\n')
 
 
-def legs_to_facts(legs, distance_precision, duration_precision):
+def dump_geojson_with_compact_geometry(geojson, f):
+    write_geojson_features(geojson['features'], f)
+
+
+def exchange_ids(legs):
+    """
+    :return: {exchange name: exchange id}
+    """
+    ids = {}
+    for leg in legs.values():
+        ids[leg["start_name"]] = leg["start_exchange"]
+        ids[leg["end_name"]] = leg["end_exchange"]
+    return ids
+
+
+def commute_distances(exchange_coords, targets=None, radius=None):
+    """
+    Straight-line distances between exchanges, in both directions.
+    :param exchange_coords: {exchange id: (lat, lon, ...)}
+    :param targets: Only include distances to and from these exchange IDs. Defaults to every exchange.
+    :param radius: Count exchanges more than this many miles apart as exactly this far apart
+    :return: [(start id, end id, miles)]
+    """
+    ids = np.array(sorted(exchange_coords))
+    coords = np.array([exchange_coords[id][:2] for id in ids], dtype=float)
+    # Entry [j, i] is the distance from exchange i to exchange j. Measure each pair once so both directions get
+    # exactly the same distance.
+    upper = np.triu(haversine.haversine_vector(coords, coords, unit=haversine.Unit.MILES, comb=True).T, 1)
+    distances = upper + upper.T
+    if radius is not None:
+        distances = np.minimum(distances, radius)
+    keep = np.ones(distances.shape, dtype=bool)
+    if targets is not None:
+        is_target = np.isin(ids, list(targets))
+        keep &= is_target[:, np.newaxis] | is_target[np.newaxis, :]
+    starts, ends = np.nonzero(keep)
+    return [(int(ids[i]), int(ids[j]), float(distances[i, j])) for i, j in zip(starts, ends)]
+
+
+def legs_to_facts(legs, distance_precision, duration_precision, commute_targets=None, commute_radius=None):
+    """
+    :param commute_targets: Only generate commute distances to and from these exchange IDs (e.g. the participants'
+        preferred end exchanges). Defaults to every exchange.
+    :param commute_radius: Cap commute distances at this many miles
+    """
     facts = []
     Distance = DistanceK(distance_precision)
     for id, leg in legs.items():
@@ -248,33 +439,19 @@ def legs_to_facts(legs, distance_precision, duration_precision):
             facts.append(attribute_type(clingo.Number(leg["start_exchange"]), clingo.Number(leg["end_exchange"])))
             facts.append(attribute_type(clingo.Number(leg["end_exchange"]), clingo.Number(leg["start_exchange"])))
     exchanges = set()
-    exchange_coords = []
+    exchange_coords = {}
+    # An exchange is where the first leg (in key order) to touch it starts or ends. The tracks meeting at an exchange
+    # end up to tens of meters apart, so commute distances depend on which one that is, by up to about 0.04mi.
     for leg in legs.values():
         exchanges.add((leg["start_exchange"], leg["start_name"]))
         exchanges.add((leg["end_exchange"], leg["end_name"]))
-        exchange_coords.append((leg["start_exchange"], leg["coordinates"][0]))
-        exchange_coords.append((leg["end_exchange"], leg["coordinates"][-1]))
-
-    # Remove duplicates
-    exchange_coords_set = set()
-    unique_tracker = set()
-    for id, coord in exchange_coords:
-        if id not in unique_tracker:
-            unique_tracker.add(id)
-            exchange_coords_set.add((id, coord))
+        exchange_coords.setdefault(leg["start_exchange"], tuple(leg["coordinates"][0]))
+        exchange_coords.setdefault(leg["end_exchange"], tuple(leg["coordinates"][-1]))
 
     for id, exchange in exchanges:
         facts.append(ExchangeName(id=id, name=exchange))
 
     CommuteDistance = CommuteDistanceK(distance_precision)
-    pairwise_distances = []
-    for id1, coord1 in exchange_coords_set:
-        for id2, coord2 in exchange_coords_set:
-            if id1 < id2:
-                pairwise_distances.append((id1, id2, haversine.haversine(coord1[:2], coord2[:2], unit=haversine.Unit.MILES)))
-                facts.append(CommuteDistance(start_id=id1, end_id=id2, dist=pairwise_distances[-1][2]))
-                facts.append(CommuteDistance(start_id=id2, end_id=id1, dist=pairwise_distances[-1][2]))
-            if id1 == id2:
-                facts.append(CommuteDistance(start_id=id1, end_id=id2, dist=0))
-                facts.append(CommuteDistance(start_id=id2, end_id=id1, dist=0))
+    for id1, id2, dist in commute_distances(exchange_coords, targets=commute_targets, radius=commute_radius):
+        facts.append(CommuteDistance(start_id=id1, end_id=id2, dist=dist))
     return facts
@@ -0,0 +1,214 @@
+from collections import defaultdict
+
+import clingo.ast as ast
+from clingo import SymbolType
+from tabulate import tabulate
+
+AUXILIARY = "(auxiliary)"
+CONSTRAINTS = "(integrity constraints)"
+
+
+class GroundProfiler:
+    """
+    Clingo observer that tallies the ground program by the signature of each rule's head. Register it with
+    `ctrl.register_observer` before grounding.
+
+    Clingo introduces auxiliary atoms for aggregates and conditions. Rules defining them are charged to whatever uses
+    the auxiliary atom: the head of the rule it appears in, an integrity constraint or a minimize statement.
+    """
+
+    def __init__(self):
+        self.symbols = {}
+        self.facts = defaultdict(int)
+        self.head_rules = defaultdict(lambda: [0, 0, 0])
+        self.constraints = [0, 0, 0]
+        # First rule head (atom), CONSTRAINTS or minimize priority (tuple) each atom appears in the body of
+        self.consumers = {}
+        self.minimize_literals = defaultdict(int)
+        self.choice_rules = 0
+
+    def rule(self, choice, head, body):
+        self.choice_rules += choice
+        self._add(choice, head, body, 0)
+
+    def weight_rule(self, choice, head, lower_bound, body):
+        self.choice_rules += choice
+        self._add(choice, head, [literal for literal, _ in body], 1)
+
+    def _add(self, choice, head, body, weight):
+        if not head and not choice:
+            counts = self.constraints
+            consumer = CONSTRAINTS
+        else:
+            # Index by the first head atom. Disjunctive and choice heads almost always share a signature.
+            consumer = head[0] if head else 0
+            counts = self.head_rules[consumer]
+        counts[0] += 1
+        counts[1] += weight
+        counts[2] += len(body)
+        for literal in body:
+            self.consumers.setdefault(abs(literal), consumer)
+
+    def minimize(self, priority, literals):
+        self.minimize_literals[priority] += len(literals)
+        for literal, _ in literals:
+            self.consumers.setdefault(abs(literal), (priority,))
+
+    def output_atom(self, symbol, atom):
+        # Facts are output as atom 0
+        if atom == 0:
+            self.facts[(symbol.name, len(symbol.arguments))] += 1
+        else:
+            self.symbols[atom] = symbol
+
+    def _owner(self, atom):
+        seen = set()
+        while atom not in self.symbols:
+            consumer = self.consumers.get(atom)
+            if consumer is None or atom in seen:
+                return AUXILIARY
+            if not isinstance(consumer, int):
+                return consumer
+            seen.add(atom)
+            atom = consumer
+        symbol = self.symbols[atom]
+        return symbol.name, len(symbol.arguments)
+
+    def signatures(self):
+        """
+        :return: ({signature: {"atoms", "facts", "rules", "aggregates", "body_literals"}},
+            {minimize priority: {"rules", "aggregates", "body_literals"}} for auxiliary rules feeding minimize
+            statements)
+        """
+        profile = defaultdict(lambda: {"atoms": 0, "facts": 0, "rules": 0, "aggregates": 0, "body_literals": 0})
+        minimize = defaultdict(lambda: {"rules": 0, "aggregates": 0, "body_literals": 0})
+        for signature, count in self.facts.items():
+            profile[signature]["facts"] += count
+            profile[signature]["atoms"] += count
+        for symbol in self.symbols.values():
+            profile[(symbol.name, len(symbol.arguments))]["atoms"] += 1
+        for atom, (rules, aggregates, body_literals) in self.head_rules.items():
+            if atom not in self.symbols and body_literals == 0 and aggregates == 0:
+                # Facts added through the backend become body-less rules over atoms that are then output as facts
+                continue
+            owner = self._owner(atom)
+            entry = minimize[owner[0]] if len(owner) == 1 else profile[owner]
+            entry["rules"] += rules
+            entry["aggregates"] += aggregates
+            entry["body_literals"] += body_literals
+        if self.constraints[0]:
+            entry = profile[CONSTRAINTS]
+            entry["rules"] += self.constraints[0]
+            entry["aggregates"] += self.constraints[1]
+            entry["body_literals"] += self.constraints[2]
+        return dict(profile), dict(minimize)
+
+
+def _signature(term):
+    if term.ast_type == ast.ASTType.Function:
+        return term.name, len(term.arguments)
+    if term.ast_type == ast.ASTType.SymbolicTerm and term.symbol.type == SymbolType.Function:
+        return term.symbol.name, len(term.symbol.arguments)
+    return None
+
+
+def _literal_signature(literal):
+    if literal.ast_type == ast.ASTType.Literal and literal.atom.ast_type == ast.ASTType.SymbolicAtom:
+        return _signature(literal.atom.symbol)
+    return None
+
+
+def _head_signatures(head):
+    if head.ast_type == ast.ASTType.Literal:
+        signature = _literal_signature(head)
+        return [signature] if signature else []
+    if head.ast_type in (ast.ASTType.Aggregate, ast.ASTType.Disjunction):
+        return [s for s in (_literal_signature(element.literal) for element in head.elements) if s]
+    if head.ast_type == ast.ASTType.HeadAggregate:
+        return [s for s in (_literal_signature(element.condition.literal) for element in head.elements) if s]
+    return []
+
+
+def _objective_name(body):
+    for literal in body:
+        if _literal_signature(literal) == ("objective", 2):
+            name = literal.atom.symbol.arguments[1]
+            if name.ast_type == ast.ASTType.SymbolicTerm and name.symbol.type == SymbolType.String:
+                return name.symbol.string
+    return None
+
+
+def rule_sources(files):
+    """
+    Find where each predicate is defined in the program files.
+    :return: ({signature: ["file:line", ...]}, ["file:line" of integrity constraints], {objective name: ["file:line"]})
+    """
+    defined = defaultdict(list)
+    constraints = []
+    objectives = defaultdict(list)
+
+    def visit(stm):
+        location = f"{stm.location.begin.filename}:{stm.location.begin.line}"
+        if stm.ast_type == ast.ASTType.Rule:
+            signatures = _head_signatures(stm.head)
+            if not signatures and stm.head.ast_type == ast.ASTType.Literal:
+                constraints.append(location)
+            for signature in set(signatures):
+                defined[signature].append(location)
+        elif stm.ast_type == ast.ASTType.Minimize:
+            objectives[_objective_name(stm.body)].append(location)
+
+    ast.parse_files(files, visit)
+    # Each element of a #minimize statement becomes its own Minimize node
+    return dict(defined), constraints, {name: sorted(set(locations)) for name, locations in objectives.items()}
+
+
+def build_report(profiler, files, objectives_by_priority):
+    """
+    Combine the ground program tallies with where each predicate is defined.
+    :param objectives_by_priority: {priority: objective name}
+    """
+    defined, constraints, objectives = rule_sources(files)
+    signatures = []
+    by_signature, by_priority = profiler.signatures()
+    for signature, counts in by_signature.items():
+        if signature == CONSTRAINTS:
+            name, sources = signature, constraints
+        elif signature == AUXILIARY:
+            name, sources = signature, []
+        else:
+            name, sources = f"{signature[0]}/{signature[1]}", defined.get(signature, [])
+        signatures.append({"signature": name, **counts, "sources": sources})
+    signatures.sort(key=lambda entry: (entry["body_literals"] + entry["rules"], entry["atoms"]), reverse=True)
+
+    minimize = []
+    for priority, literals in sorted(profiler.minimize_literals.items(), reverse=True):
+        name = objectives_by_priority.get(priority)
+        counts = by_priority.get(priority, {"rules": 0, "aggregates": 0, "body_literals": 0})
+        minimize.append({"priority": priority, "objective": name, "literals": literals, **counts,
+                         "sources": objectives.get(name, [])})
+
+    totals = {
+        "atoms": sum(entry["atoms"] for entry in signatures),
+        "facts": sum(entry["facts"] for entry in signatures),
+        "rules": sum(entry["rules"] for entry in signatures + minimize),
+        "choice_rules": profiler.choice_rules,
+        "aggregates": sum(entry["aggregates"] for entry in signatures + minimize),
+        "body_literals": sum(entry["body_literals"] for entry in signatures + minimize),
+        "minimize_literals": sum(entry["literals"] for entry in minimize),
+    }
+    return {"totals": totals, "signatures": signatures, "minimize": minimize}
+
+
+def report_to_str(report, limit=None):
+    signatures = report["signatures"][:limit]
+    rows = [[entry["signature"], entry["atoms"], entry["facts"], entry["rules"], entry["aggregates"],
+             entry["body_literals"], ", ".join(entry["sources"])] for entry in signatures]
+    table = tabulate(rows, headers=["Signature", "Atoms", "Facts", "Rules", "Aggregates", "Body literals",
+                                    "Defined at"])
+    minimize = tabulate([[entry["priority"], entry["objective"], entry["literals"], entry["rules"], entry["aggregates"],
+                          entry["body_literals"], ", ".join(entry["sources"])] for entry in report["minimize"]],
+                        headers=["Priority", "Objective", "Literals", "Rules", "Aggregates", "Body literals",
+                                 "Defined at"])
+    totals = ", ".join(f"{value} {name.replace('_', ' ')}" for name, value in report["totals"].items())
+    return f"{table}\n\n{minimize}\n\nTotal: {totals}"
@@ -10,6 +10,9 @@ from relay_scheduler.domain import PreferredDistanceK, PreferredPaceK, LegPaceK,
 
 from collections import defaultdict
 
+# Seconds added at each exchange by default, for the printed schedules and the simulated races alike
+EXCHANGE_OVERHEAD = 45
+
 
 def find_all_paths(edges):
     graph = defaultdict(list)
@@ -106,7 +109,9 @@ def extract_assignments(facts: clorm.FactBase, distance_precision: float, durati
                        facts.query(PreferredPace).group_by(PreferredPace.name).select(PreferredPace.pace).all()}
     pace_deviations = {runner: list(map(lambda actual: actual - preferred_paces[runner], paces)) for runner, paces in leg_paces.items()}
     runner_pref_end = dict(facts.query(PreferredEndExchange).select(PreferredEndExchange.name, PreferredEndExchange.exchange_id).all())
-    runner_end_dev = {runner: facts.query(CommuteDistance).where(CommuteDistance.start_id == start_end_exchanges[runner][-1][1], CommuteDistance.end_id == runner_pref_end[runner]).select(CommuteDistance.dist).first() for runner in runner_pref_end.keys()}
+    # Commute distances may have been left out (see the commute targets of legs_to_facts), though never for being beyond
+    # the commute radius, which only caps them. Like the commute-pref objective, count missing ones as 0
+    runner_end_dev = {runner: next(iter(facts.query(CommuteDistance).where(CommuteDistance.start_id == start_end_exchanges[runner][-1][1], CommuteDistance.end_id == runner_pref_end[runner]).select(CommuteDistance.dist).all()), 0) for runner in runner_pref_end.keys()}
     runner_preferred_dist = dict(facts.query(PreferredDistance)
                         .select(PreferredDistance.name, PreferredDistance.distance)
                         .all())
@@ -173,7 +178,31 @@ def assignments_to_str(assignments):
     return tabulate(rows, headers=["Runner", "Start", "End", "Distance", "Paces", "Ascent", "Loss Distance", "Loss Commute", "Loss Pace"])
 
 
-def schedule_to_str(schedule, exchange_overhead=45, ascent_factor=10):
+def adjusted_pace(leg, ascent_factor=10):
+    """
+    :param ascent_factor: Number of seconds per mile to add per 100 feet of elevation gain
+    :return: The leg's pace in seconds per mile, slowed for elevation gain
+    """
+    # Add a little time for elevation gain, only in 5s/mi per 50ft/mi of gain increments
+    return leg["pace_mi"] + math.floor((leg["ascent_ft"] / leg["distance_mi"] / 50)) * (ascent_factor / 2)
+
+
+def exchange_buffers(schedule, exchange_overhead=EXCHANGE_OVERHEAD):
+    """
+    :param exchange_overhead: The time to add at each exchange. Halved for exchanges with no new runners
+    :return: The time added to each leg for its exchange
+    """
+    buffers = []
+    previous_runners = set()
+    for leg in schedule:
+        # Are there new runners on this leg?
+        starting_runners = set(leg["runners"]) - previous_runners
+        buffers.append(exchange_overhead if starting_runners else exchange_overhead // 2)
+        previous_runners = set(leg["runners"])
+    return buffers
+
+
+def schedule_to_str(schedule, exchange_overhead=EXCHANGE_OVERHEAD, ascent_factor=10):
     """
     Convert a schedule to a pretty string
     :param schedule: The schedule to convert
@@ -182,32 +211,23 @@ def schedule_to_str(schedule, exchange_overhead=45, ascent_factor=10):
     """
     start_offset = 0
     rows = []
-    previous_runners = set()
-    for leg in schedule:
+    for leg, exchange_buffer in zip(schedule, exchange_buffers(schedule, exchange_overhead)):
         leg_num = leg["leg"]
-        # Add a little time for elevation gain, only in 5s/mi per 50ft/mi of gain increments
-        pace = leg["pace_mi"] + math.floor((leg["ascent_ft"] / leg["distance_mi"] / 50)) * (ascent_factor / 2)
+        pace = adjusted_pace(leg, ascent_factor)
         pace_pretty = pace_to_str(pace)
         offset_pretty = pace_to_str(start_offset)
         leg_participants = ', '.join(sorted(leg["runners"]))
         rows.append([leg_num, offset_pretty, leg["start_exchange_name"], leg["distance_mi"], pace_pretty, leg["ascent_ft"],
                      leg.get("leader", None), leg_participants])
         leg_duration = pace * leg["distance_mi"]
-        # Are there new runners on this leg?
-        starting_runners = set(leg["runners"]) - previous_runners
-        if not starting_runners:
-            exchange_buffer = exchange_overhead // 2
-        else:
-            exchange_buffer = exchange_overhead
         start_offset += math.ceil(exchange_buffer + leg_duration)
-        previous_runners = set(leg["runners"])
     offset_pretty = pace_to_str(start_offset)
     rows.append(
         ["Total", offset_pretty, "", sum(x["distance_mi"] for x in schedule), "", sum(x["ascent_ft"] for x in schedule), "", ""])
     return tabulate(rows, headers=["Leg", "Offset", "Start", "Distance", "Pace", "Ascent", "Leader", "Runners"])
 
 
-def schedule_to_rows(schedule, exchange_overhead=45, ascent_factor=10):
+def schedule_to_rows(schedule, exchange_overhead=EXCHANGE_OVERHEAD, ascent_factor=10):
     """
     Convert a schedule to a list of rows
     :param schedule: The schedule to convert
@@ -216,22 +236,13 @@ def schedule_to_rows(schedule, exchange_overhead=45, ascent_factor=10):
     """
     start_offset = 0
     rows = [["Leg", "Start Station", "Leader", "Runners", "Distance (mi)", "Pace /mi", "Scheduled Start"]]
-    previous_runners = set()
-    for leg in schedule:
+    for leg, exchange_buffer in zip(schedule, exchange_buffers(schedule, exchange_overhead)):
         leg_num = leg["leg"]
-        # Add a little time for elevation gain, only in 5s/mi per 50ft/mi of gain increments
-        pace = leg["pace_mi"] + math.floor((leg["ascent_ft"] / leg["distance_mi"] / 50)) * (ascent_factor / 2)
+        pace = adjusted_pace(leg, ascent_factor)
         pace_pretty = pace_to_str(pace)
         offset_pretty = pace_to_str(start_offset)
         leg_participants = ', '.join(sorted(leg["runners"]))
         rows.append([leg_num, leg["start_exchange_name"], leg.get("leader", None), leg_participants, leg["distance_mi"], pace_pretty, offset_pretty])
         leg_duration = pace * leg["distance_mi"]
-        # Are there new runners on this leg?
-        starting_runners = set(leg["runners"]) - previous_runners
-        if not starting_runners:
-            exchange_buffer = exchange_overhead // 2
-        else:
-            exchange_buffer = exchange_overhead
         start_offset += math.ceil(exchange_buffer + leg_duration)
-        previous_runners = set(leg["runners"])
     return rows
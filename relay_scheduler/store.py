@@ -0,0 +1,94 @@
+import json
+import sqlite3
+import zlib
+
+STORE_FILENAME = "solutions.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS solutions (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    found_time TEXT NOT NULL,
+    compute_time REAL NOT NULL,
+    optimal INTEGER NOT NULL,
+    costs TEXT NOT NULL,
+    solution TEXT NOT NULL,
+    atoms BLOB
+);
+CREATE INDEX IF NOT EXISTS solutions_optimal ON solutions (optimal);
+"""
+
+
+class SolutionStore:
+    """
+    Every model found by a solve, in one SQLite database instead of a JSON, CSV and .lp file per model. Models are
+    stored once per hash, with their atoms compressed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Models are saved from the writer thread. Only one thread uses the connection at a time.
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def add(self, solution, name, atoms=None):
+        """
+        Record a solution, in the form `save_solution` writes to JSON. Each model is committed as it's added, so
+        an interrupted solve keeps everything found so far.
+        :return: False if a solution with the same hash was already stored. It's marked optimal if this one is.
+        """
+        existing = self.db.execute("SELECT optimal FROM solutions WHERE hash = ?", (solution["hash"],)).fetchone()
+        with self.db:
+            if existing is None:
+                compressed = None
+                if atoms:
+                    compressed = zlib.compress("".join(f"{atom}.\n" for atom in atoms).encode())
+                self.db.execute("INSERT INTO solutions (hash, name, found_time, compute_time, optimal, costs, "
+                                "solution, atoms) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                (solution["hash"], name, solution["foundTime"], solution["computeTime"],
+                                 solution["optimal"], json.dumps(solution["costs"]), json.dumps(solution),
+                                 compressed))
+                return True
+            if solution["optimal"] and not existing[0]:
+                # Clingo reports the model that turns out to be optimal again once it's proven
+                self.db.execute("UPDATE solutions SET optimal = 1, solution = json_set(solution, '$.optimal', json('true')) "
+                                "WHERE hash = ?", (solution["hash"],))
+        return False
+
+    def summaries(self, optimal_only=False, hash_prefix=None):
+        """
+        :return: [{"id", "hash", "name", "optimal", "costs", "compute_time"}] in the order they were found
+        """
+        query = "SELECT id, hash, name, optimal, costs, compute_time FROM solutions"
+        conditions, params = [], []
+        if optimal_only:
+            conditions.append("optimal")
+        if hash_prefix:
+            conditions.append("hash LIKE ? || '%'")
+            params.append(hash_prefix)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = self.db.execute(query + " ORDER BY id", params).fetchall()
+        return [{"id": id, "hash": hash, "name": name, "optimal": bool(optimal), "costs": json.loads(costs),
+                 "compute_time": compute_time} for id, hash, name, optimal, costs, compute_time in rows]
+
+    def best(self, n):
+        """
+        :return: Summaries of the `n` lowest cost solutions (compared lexicographically by priority), best first
+        """
+        return sorted(self.summaries(), key=lambda summary: (list(summary["costs"].values()), summary["id"]))[:n]
+
+    def solution(self, id):
+        return json.loads(self.db.execute("SELECT solution FROM solutions WHERE id = ?", (id,)).fetchone()[0])
+
+    def atoms(self, id):
+        """
+        :return: The model's atoms as ASP facts, or None if they weren't stored
+        """
+        compressed = self.db.execute("SELECT atoms FROM solutions WHERE id = ?", (id,)).fetchone()[0]
+        return None if compressed is None else zlib.decompress(compressed).decode()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,73 @@
+import numpy as np
+from tabulate import tabulate
+
+from relay_scheduler.schedule import adjusted_pace, exchange_buffers, pace_to_str, EXCHANGE_OVERHEAD
+
+DEFAULT_PERCENTILES = (10, 50, 90)
+
+
+def preferred_paces(assignments):
+    """
+    :param assignments: From `extract_assignments`
+    :return: {runner: preferred pace in seconds per mile}
+    """
+    # Each leg's pace deviation is measured against the runner's preferred pace
+    return {r["runner"]: r["paces"][0] - r["loss_pace"][0] for r in assignments if r["paces"]}
+
+
+def simulate_start_offsets(schedule, assignments, races=10000, pace_sd=0.04, exchange_sd=0.5,
+                           exchange_overhead=EXCHANGE_OVERHEAD, ascent_factor=10, seed=None):
+    """
+    Simulate many races at once. The planned times are those of `schedule_to_str`, varied by:
+     - Each runner's form on the day: a lognormal factor on their preferred pace, with `pace_sd` the standard deviation
+       of its log, drawn once per race and shared by all of their legs. Groups run at the pace of whichever member is
+       slowest on the day, so a fast runner's off day only slows a group down if it makes them the slowest.
+     - Each exchange's overhead: gamma distributed around the planned overhead, with `exchange_sd` its coefficient of
+       variation.
+    :param assignments: From `extract_assignments`, for the runners' preferred paces
+    :return: (races, legs + 1) array of the seconds from the start each leg started, then the finish
+    """
+    rng = np.random.default_rng(seed)
+    runners = sorted({runner for leg in schedule for runner in leg["runners"]})
+    runner_index = {runner: i for i, runner in enumerate(runners)}
+    form = rng.lognormal(0.0, pace_sd, size=(races, len(runners)))
+    paces = preferred_paces(assignments)
+
+    durations = np.empty((races, len(schedule)))
+    for i, leg in enumerate(schedule):
+        climb = adjusted_pace(leg, ascent_factor) - leg["pace_mi"]
+        members = [runner_index[runner] for runner in leg["runners"]]
+        member_paces = np.array([paces.get(runner, leg["pace_mi"]) + climb for runner in leg["runners"]])
+        durations[:, i] = leg["distance_mi"] * (member_paces * form[:, members]).max(axis=1)
+
+    buffers = np.array(exchange_buffers(schedule, exchange_overhead), dtype=float)
+    if exchange_sd > 0:
+        shape = 1 / exchange_sd ** 2
+        overheads = rng.gamma(shape, buffers / shape, size=(races, len(schedule)))
+    else:
+        overheads = np.broadcast_to(buffers, (races, len(schedule)))
+
+    offsets = np.zeros((races, len(schedule) + 1))
+    np.cumsum(durations + overheads, axis=1, out=offsets[:, 1:])
+    return offsets
+
+
+def arrival_percentiles(offsets, percentiles=DEFAULT_PERCENTILES):
+    """
+    :param offsets: From `simulate_start_offsets`
+    :return: (legs + 1, len(percentiles)) array of the percentiles of each leg's start and the finish
+    """
+    return np.percentile(offsets, percentiles, axis=0).T
+
+
+def arrivals_to_str(schedule, arrivals, percentiles=DEFAULT_PERCENTILES):
+    """
+    Convert the arrival percentiles at each exchange to a pretty string
+    """
+    # Whole seconds, so that pace_to_str doesn't round 59.6s up to ":60"
+    arrivals = np.rint(arrivals)
+    rows = []
+    for leg, times in zip(schedule, arrivals):
+        rows.append([leg["leg"], leg["start_exchange_name"], *map(pace_to_str, times)])
+    rows.append(["Finish", schedule[-1]["end_exchange_name"], *map(pace_to_str, arrivals[-1])])
+    return tabulate(rows, headers=["Leg", "Exchange", *(f"P{p:g}" for p in percentiles)])
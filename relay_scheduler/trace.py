@@ -0,0 +1,78 @@
+import json
+import threading
+
+TRACE_FILENAME = "trace.jsonl"
+
+
+def optimality_gap(costs, lower):
+    """
+    Relative gap between lexicographic costs and lower bounds, at the most important priority where they differ
+    :param lower: Bounds for the most important priorities. Core-guided strategies bound one priority after another.
+    :return: 0.0 if the costs meet the bounds, None if there are no bounds for the priority that matters
+    """
+    if lower is None:
+        return None
+    for cost, bound in zip(costs, lower):
+        if cost > bound:
+            return (cost - bound) / max(abs(cost), 1)
+    return 0.0 if len(lower) >= len(costs) else None
+
+
+class ConvergenceTrace:
+    """
+    Writes a JSON line for each model and each new lower bound as they're found, so that a run can be stopped once
+    it's good enough and its convergence plotted afterwards. Lower bounds come from clingo's `on_unsat` callback,
+    which only core-guided optimization strategies (usc) call. Models and bounds are reported from different
+    threads.
+    """
+
+    def __init__(self, path, start_time):
+        self.f = open(path, "w")
+        self.start_time = start_time
+        self.lock = threading.Lock()
+        self.costs = None
+        self.lower = None
+        self.gap = None
+        self.models = 0
+
+    def _write(self, record, time):
+        record = {"time": (time - self.start_time).total_seconds(), **record}
+        self.f.write(json.dumps(record) + "\n")
+        self.f.flush()
+
+    def model(self, costs, time):
+        """
+        :param costs: Costs of the model keyed by objective name, from most to least important
+        """
+        with self.lock:
+            self.models += 1
+            self.costs = costs
+            self.gap = optimality_gap(list(costs.values()), self.lower)
+            self._write({"event": "model", "model": self.models - 1, "costs": costs,
+                         "lower": None if self.lower is None else dict(zip(costs, self.lower)), "gap": self.gap},
+                        time)
+
+    def bound(self, lower, time):
+        """
+        :param lower: Lower bounds in the same order as a model's costs
+        """
+        with self.lock:
+            self.lower = list(lower)
+            if self.costs is not None:
+                self.gap = optimality_gap(list(self.costs.values()), self.lower)
+            self._write({"event": "bound", "lower": self.lower, "gap": self.gap}, time)
+
+    def finish(self, statistics, time):
+        """
+        Record the solver's search statistics. Clingo only makes them available once solving stops.
+        """
+        solvers = statistics["solving"]["solvers"]
+        summary = statistics["summary"]
+        with self.lock:
+            self._write({"event": "finish", "models": self.models, "gap": self.gap,
+                         "exhausted": bool(summary["exhausted"]), "lower": self.lower,
+                         "conflicts": int(solvers["conflicts"]), "choices": int(solvers["choices"]),
+                         "restarts": int(solvers["restarts"]), "solve_time": summary["times"]["solve"]}, time)
+
+    def close(self):
+        self.f.close()
@@ -10,18 +10,55 @@ from clingo.symbol import Number
 
 from relay_scheduler.domain import duration, kPrecision
 
+# @-functions that convert strings, e.g. @k("10.5", "2"). Their arguments are never transformed: clingo has to call
+# them with the same arguments as were written when they can't be folded.
+CONVERSIONS = {"k": lambda val, precision: kPrecision(float(val), precision), "duration": duration}
+ARITHMETIC = {"min": min, "max": max}
+
+
+def fold(node, func, arg_type=None):
+    """
+    :return: A term for the value of the external function call `node`, or None if its arguments aren't all
+        constants (of `arg_type`, if given) or `func` rejects them
+    """
+    args = []
+    for arg in node.arguments:
+        if arg.ast_type != ast.ASTType.SymbolicTerm or arg_type not in (None, arg.symbol.type):
+            return None
+        if arg.symbol.type == clingo.SymbolType.Number:
+            args.append(arg.symbol.number)
+        elif arg.symbol.type == clingo.SymbolType.String:
+            args.append(arg.symbol.string)
+        else:
+            return None
+    try:
+        return ast.SymbolicTerm(node.location, Number(func(*args)))
+    except (TypeError, ValueError):
+        return None
+
 
 class FloatPaceTransformer(Transformer):
     """
     Transforms terms of the form term("1.5") into term(150), and term("1:30") into term(90).
     See also the `kPrecision` and `duration` functions in `relay_scheduler/domain.py`, which
-    back the @-functions for manually applying these transforms within ASP files.
+    back the @-functions for manually applying these transforms within ASP files. Calls to those
+    functions (and to @min and @max) with constant arguments are folded, so clingo doesn't call
+    into Python for them while grounding.
     """
 
     def __init__(self, distance_precision=2.0, duration_precision=0.0):
         self.distance_precision = distance_precision
         self.duration_precision = duration_precision
 
+    def visit_Function(self, node):
+        if node.external and node.name in CONVERSIONS:
+            # @k("10.5", "2") is 10.5 at a precision of 2, not "10.5" transformed into 1050 first
+            return fold(node, CONVERSIONS[node.name]) or node
+        node = node.update(**self.visit_children(node))
+        if node.external and node.name in ARITHMETIC:
+            return fold(node, ARITHMETIC[node.name], clingo.SymbolType.Number) or node
+        return node
+
     def visit_SymbolicTerm(self, node):
         if node.symbol.type == clingo.SymbolType.String:
             if ":" in node.symbol.string:
@@ -0,0 +1,131 @@
+from clingo import HeuristicType, SymbolType
+
+# The objectives that only depend on a runner's own segment, so each runner's best segment can be found on its own
+SEPARABLE_OBJECTIVES = ["dist-pref-overage", "dist-pref", "commute-pref"]
+MODIFIERS = {"sign": (HeuristicType.Sign, HeuristicType.Sign), "level": (HeuristicType.True_, HeuristicType.False_)}
+
+
+def ground_facts(symbolic_atoms, name, arity):
+    """
+    :return: Arguments of the name/arity facts in the ground program, as Python ints and strings
+    """
+    facts = []
+    for atom in symbolic_atoms.by_signature(name, arity):
+        if atom.is_fact:
+            facts.append(tuple(arg.number if arg.type == SymbolType.Number else arg.string
+                               for arg in atom.symbol.arguments))
+    return facts
+
+
+def greedy_schedule(symbolic_atoms):
+    """
+    Build a contiguous schedule from the instance's preferences, without solving. Each runner gets the segment of two
+    or more legs that's best for them under the objectives that only depend on their own segment (distance and commute
+    preferences, in the instance's priority order). Willing leaders are then moved to segments that cover any leg no
+    leader runs, at the least cost to them, and each leg is led by the leader whose segment goes on the longest.
+    Works on the ground program, in the same fixed precision as the objectives.
+    :return: ({runner: (first leg, last leg)}, {leg: leader})
+    """
+    leg_end = {leg: end for leg, _, end in ground_facts(symbolic_atoms, "leg", 3)}
+    leg_dist = dict(ground_facts(symbolic_atoms, "legDist", 2))
+    legs = sorted(leg_end)
+    runners = sorted(runner for runner, in ground_facts(symbolic_atoms, "participant", 1))
+    preferred_distance = dict(ground_facts(symbolic_atoms, "preferredDistance", 2))
+    preferred_end = dict(ground_facts(symbolic_atoms, "preferredEndExchange", 2))
+    commute_distance = {(start, end): dist for start, end, dist in ground_facts(symbolic_atoms, "commuteDistance", 3)}
+    leaders = sorted(runner for runner, in ground_facts(symbolic_atoms, "willingToLead", 1))
+    priorities = {name: priority for priority, name in ground_facts(symbolic_atoms, "objective", 2)}
+    objectives = sorted((name for name in SEPARABLE_OBJECTIVES if name in priorities), key=lambda name: -priorities[name])
+
+    distance_to = [0]
+    for leg in legs:
+        distance_to.append(distance_to[-1] + leg_dist.get(leg, 0))
+    ranges = [(first, last) for i, first in enumerate(legs) for last in legs[i + 1:]]
+
+    def cost(runner, segment):
+        first, last = segment
+        distance = distance_to[legs.index(last) + 1] - distance_to[legs.index(first)]
+        deviation = distance - preferred_distance.get(runner, distance)
+        costs = {"dist-pref-overage": max(deviation, 0), "dist-pref": abs(deviation), "commute-pref": 0}
+        if runner in preferred_end:
+            costs["commute-pref"] = commute_distance.get((preferred_end[runner], leg_end[last]), 0)
+        # Fewer runners on a leg keeps its pace (and the race) quicker
+        return [costs[name] for name in objectives] + [last - first]
+
+    segments = {runner: min(ranges, key=lambda segment: cost(runner, segment)) for runner in runners}
+
+    def unled(segments):
+        return [leg for leg in legs if not any(segments[leader][0] <= leg <= segments[leader][1] for leader in leaders)]
+
+    # Each move covers at least one more leg, so this ends
+    uncovered = unled(segments)
+    while uncovered and leaders:
+        leg = uncovered[0]
+        moves = []
+        for leader in leaders:
+            for segment in ranges:
+                if segment[0] <= leg <= segment[1]:
+                    moved = {**segments, leader: segment}
+                    added = [new - old for new, old in zip(cost(leader, segment), cost(leader, segments[leader]))]
+                    moves.append((len(unled(moved)), added, leader, segment))
+        remaining, _, leader, segment = min(moves)
+        if remaining >= len(uncovered):
+            break
+        segments[leader] = segment
+        uncovered = unled(segments)
+
+    leader_on = {}
+    current = None
+    for leg in legs:
+        if current is None or segments[current][1] < leg:
+            candidates = [leader for leader in leaders if segments[leader][0] <= leg <= segments[leader][1]]
+            current = max(candidates, key=lambda leader: segments[leader][1], default=None)
+        if current is not None:
+            leader_on[leg] = current
+    return segments, leader_on
+
+
+def schedule_atoms(symbolic_atoms, segments, leader_on):
+    """
+    :return: Generator of (symbolic atom, whether the schedule has it) for every run/2 and leaderOn/2 atom the solver
+        can choose
+    """
+    picked = {("run", runner, leg) for runner, (first, last) in segments.items() for leg in range(first, last + 1)}
+    picked.update(("leaderOn", runner, leg) for leg, runner in leader_on.items())
+    for name in ["run", "leaderOn"]:
+        for atom in symbolic_atoms.by_signature(name, 2):
+            if not atom.is_fact:
+                yield atom, (name, atom.symbol.arguments[0].string, atom.symbol.arguments[1].number) in picked
+
+
+def schedule_from_atoms(symbols):
+    """
+    :param symbols: A model's run/2 and leaderOn/2 atoms
+    :return: The contiguous schedule they describe, in the form `greedy_schedule` returns
+    """
+    segments = {}
+    leader_on = {}
+    for symbol in symbols:
+        runner, leg = symbol.arguments[0].string, symbol.arguments[1].number
+        if symbol.name == "run":
+            first, last = segments.get(runner, (leg, leg))
+            segments[runner] = (min(first, leg), max(last, leg))
+        elif symbol.name == "leaderOn":
+            leader_on[leg] = runner
+    return segments, leader_on
+
+
+def add_warm_start(ctrl, segments, leader_on, modifier="sign"):
+    """
+    Point the solver at a schedule from `greedy_schedule` with domain heuristics on run/2 and leaderOn/2. `sign` only
+    sets the value the solver tries first for each atom; `level` also makes it decide those atoms first. Either only
+    takes effect with `--heuristic=Domain`.
+    """
+    positive, negative = MODIFIERS[modifier]
+    negative_bias = -1 if modifier == "sign" else 1
+    with ctrl.backend() as backend:
+        for atom, picked in schedule_atoms(ctrl.symbolic_atoms, segments, leader_on):
+            if picked:
+                backend.add_heuristic(atom.literal, positive, 1, 1, [])
+            else:
+                backend.add_heuristic(atom.literal, negative, negative_bias, 1, [])
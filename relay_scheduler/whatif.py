@@ -0,0 +1,127 @@
+import clingo
+
+from relay_scheduler.domain import Participant, PreferredDistanceK, PreferredEndExchange, WillingToLead
+
+# Ground as its own program part alongside the event's programs. Pins are declared for every participant and leg,
+# so they can be switched on and off without regrounding.
+WHATIF_PROGRAM = """
+#external pinned(P, T) : participant(P), legTime(T).
+:- pinned(P, T), not run(P, T).
+"""
+
+
+def participant_externals(participant_facts, exchange_ids, distance_choices, distance_precision):
+    """
+    Split participant facts into the ones what-if queries can switch and the ones that stay fixed.
+
+    Roster membership, preferred distance, preferred end exchange and leader willingness become externals. Every
+    participant gets an external for each of `distance_choices` (miles) and each exchange in `exchange_ids`, so
+    those preferences can be changed to any of these values without regrounding.
+    :return: (all externals, externals that start out true, fixed facts)
+    """
+    PreferredDistance = PreferredDistanceK(distance_precision)
+    switchable = (Participant, PreferredDistance, PreferredEndExchange, WillingToLead)
+    initial = [fact for fact in participant_facts if isinstance(fact, switchable)]
+    fixed = [fact for fact in participant_facts if not isinstance(fact, switchable)]
+
+    externals = set(initial)
+    for participant in (fact for fact in participant_facts if isinstance(fact, Participant)):
+        name = participant.name
+        externals.add(WillingToLead(name=name))
+        externals.update(PreferredDistance(name=name, distance=miles) for miles in distance_choices)
+        externals.update(PreferredEndExchange(name=name, exchange_id=exchange_id) for exchange_id in exchange_ids)
+    return [fact.raw for fact in externals], [fact.raw for fact in initial], fixed
+
+
+def externals_program(externals):
+    return "\n".join(f"#external {symbol}." for symbol in sorted(externals))
+
+
+class WhatIf:
+    """
+    Tracks which switchable atoms are true and pushes changes to a ground `Control` before each solve.
+    """
+
+    def __init__(self, ctrl, externals, initial, distance_precision):
+        self.ctrl = ctrl
+        self.externals = set(externals)
+        self.initial = set(initial)
+        self.current = set(initial)
+        self.assigned = set()
+        # Atoms of dropped participants, to switch back on when they're restored
+        self.dropped = {}
+        self.PreferredDistance = PreferredDistanceK(distance_precision)
+
+    def _names(self):
+        return {symbol.arguments[0].string for symbol in self.externals if symbol.name == "participant"}
+
+    def _check_name(self, name):
+        if name not in self._names():
+            raise ValueError(f"Unknown participant {name}")
+
+    def _atoms(self, name):
+        """
+        :return: The switched on atoms for participant `name`, or the ones to restore them with if they're dropped
+        """
+        return self.dropped[name] if name in self.dropped else self.current
+
+    def _replace(self, name, predicate, symbol=None):
+        if symbol is not None and symbol not in self.externals:
+            raise ValueError(f"{symbol} wasn't declared as an external when grounding")
+        atoms = self._atoms(name)
+        atoms -= {s for s in atoms if s.name == predicate and s.arguments[0].string == name}
+        if symbol is not None:
+            atoms.add(symbol)
+
+    def set_distance(self, name, miles):
+        self._check_name(name)
+        self._replace(name, "preferredDistance", self.PreferredDistance(name=name, distance=miles).raw)
+
+    def set_end_exchange(self, name, exchange_id):
+        self._check_name(name)
+        symbol = PreferredEndExchange(name=name, exchange_id=exchange_id).raw if exchange_id is not None else None
+        self._replace(name, "preferredEndExchange", symbol)
+
+    def set_leader(self, name, willing):
+        self._check_name(name)
+        self._replace(name, "willingToLead", WillingToLead(name=name).raw if willing else None)
+
+    def set_participating(self, name, participating):
+        """
+        Dropping a participant switches off all of their atoms (preferences, leading and pins as well as roster
+        membership), so nothing refers to a runner without legs. Restoring them switches those atoms back on.
+        """
+        self._check_name(name)
+        if participating:
+            self.current |= self.dropped.pop(name, {Participant(name=name).raw})
+        elif name not in self.dropped:
+            self.dropped[name] = {s for s in self.current if s.arguments[0].string == name}
+            self.current -= self.dropped[name]
+
+    def pin(self, name, leg, pinned=True):
+        self._check_name(name)
+        symbol = clingo.Function("pinned", [clingo.String(name), clingo.Number(leg)])
+        atom = self.ctrl.symbolic_atoms[symbol]
+        if atom is None or not atom.is_external:
+            raise ValueError(f"No leg {leg}")
+        if pinned:
+            self._atoms(name).add(symbol)
+        else:
+            self._atoms(name).discard(symbol)
+
+    def reset(self):
+        self.current = set(self.initial)
+        self.dropped = {}
+
+    def changes(self):
+        """
+        Atoms switched on and off relative to the initial roster
+        """
+        return sorted(self.current - self.initial), sorted(self.initial - self.current)
+
+    def apply(self):
+        for symbol in self.assigned - self.current:
+            self.ctrl.assign_external(symbol, False)
+        for symbol in self.current - self.assigned:
+            self.ctrl.assign_external(symbol, True)
+        self.assigned = set(self.current)
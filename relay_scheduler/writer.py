@@ -0,0 +1,61 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+class BackgroundWriter:
+    """
+    Calls `handle(item)` for each item put in the queue, in order, on a background thread. Use it to keep slow
+    post-processing (extraction, printing, disk I/O) out of the solver's callbacks.
+
+    The queue is bounded, so `put` blocks once `max_queued` items are waiting. If `handle` raises, the remaining items
+    are dropped and the error is raised from the next `put` or from `close`.
+    """
+
+    def __init__(self, handle, max_queued=16):
+        self.handle = handle
+        self.items = queue.Queue(maxsize=max_queued)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="model-writer", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.items.get()
+            if item is _DONE:
+                return
+            if self.error is not None:
+                # Keep draining so producers never block on a writer that has given up
+                continue
+            try:
+                self.handle(item)
+            except BaseException as e:
+                self.error = e
+
+    def put(self, item):
+        if self.error is not None:
+            raise self.error
+        self.items.put(item)
+
+    def close(self):
+        """
+        Wait for every queued item to be handled
+        """
+        self.items.put(_DONE)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Still save whatever was found before the solve was interrupted, but don't mask the original error
+            try:
+                self.close()
+            except BaseException:
+                pass
@@ -1,37 +1,81 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
 import csv
 import datetime
 import glob
 import json
+import multiprocessing
 import os
 import pathlib
+import queue
+import random
+import shutil
+import tempfile
+import time
 
+import clingo
 import clorm
 import xxhash
-from clingo.ast import ProgramBuilder, parse_files
+from clingo.ast import parse_files
 from clorm import desc, FactBase
+from clingo.control import BackendType
 from clorm.clingo import Control
+from tabulate import tabulate
 
+from relay_scheduler.cache import build_manifest, read_manifest, write_manifest, default_cache_dir, digest_bytes, \
+    touch, write_atomically, evict
 from relay_scheduler.domain import LegCoverage, LegPaceK, Run, ExchangeName, Leg, \
     LegDistK, LegAscent, Objective, LegDescent, LeaderOn, Ascent, Descent, make_standard_func_ctx, \
     PreferredDistanceK, PreferredPaceK, DurationPrecision, DistancePrecision, WillingToLead, DistanceK, \
     PreferredEndExchange, CommuteDistanceK
-from relay_scheduler.legs import load_from_legs_bundle, legs_to_facts, relay_to_geojson, \
-    dump_geojson_with_compact_geometry
+from relay_scheduler.extract import ModelExtractor
+from relay_scheduler.legpack import PACK_FILENAME, event_legs_path, load_legs
+from relay_scheduler.legs import legs_to_facts, iter_relay_features, write_geojson_features, exchange_ids
 from relay_scheduler.participants import participants_to_facts, load_participants
+from relay_scheduler.profile import GroundProfiler, build_report, report_to_str
+from relay_scheduler.store import SolutionStore, STORE_FILENAME
 from relay_scheduler.schedule import assignments_to_str, schedule_to_str, schedule_to_rows, extract_schedule, \
-    extract_assignments
+    extract_assignments, EXCHANGE_OVERHEAD
+from relay_scheduler.timing import simulate_start_offsets, arrival_percentiles, arrivals_to_str, \
+    DEFAULT_PERCENTILES
+from relay_scheduler.trace import ConvergenceTrace, TRACE_FILENAME
+from relay_scheduler import transformer
 from relay_scheduler.transformer import FloatPaceTransformer
+from relay_scheduler.warmstart import greedy_schedule, add_warm_start, schedule_atoms, schedule_from_atoms
+from relay_scheduler.writer import BackgroundWriter
 
+GROUND_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+PROGRAM_CACHE_MAX_BYTES = 64 * 1024 * 1024
 
-def save_solution(passthrough_args, start_time, event_name="", file_name="solution", atoms=None):
+# Solver configurations for --portfolio, as clingo command line options. Core-guided (usc) optimization proves
+# optimality quickly on some instances; branch-and-bound finds good schedules early on others.
+PORTFOLIO = {
+    "bb": ["--opt-strategy=bb,lin", "--configuration=trendy"],
+    "bb-hier": ["--opt-strategy=bb,hier", "--configuration=frumpy"],
+    "usc": ["--opt-strategy=usc,oll", "--configuration=trendy"],
+    "usc-k": ["--opt-strategy=usc,k,4", "--configuration=crafty"],
+    "jumpy": ["--opt-strategy=bb,lin", "--configuration=jumpy"],
+    "vsids": ["--opt-strategy=bb,dec", "--heuristic=Vsids"],
+}
+
+def solution_dir(event_name, start_time):
+    return f"solutions/{event_name}_{start_time.isoformat().replace(':', '_')}"
+
+
+def solution_record(passthrough_args, start_time, found_time=None):
     out = {**passthrough_args}
+    found_time = found_time or datetime.datetime.now()
     out["startTime"] = start_time.isoformat()
-    out["foundTime"] = datetime.datetime.now().isoformat()
-    out["computeTime"] = (datetime.datetime.now() - start_time).total_seconds()
-    out_dir = f"solutions/{event_name}_{start_time.isoformat().replace(':', '_')}"
+    out["foundTime"] = found_time.isoformat()
+    out["computeTime"] = (found_time - start_time).total_seconds()
+    return out
+
+
+def save_solution(passthrough_args, start_time, event_name="", file_name="solution", atoms=None, found_time=None):
+    out = solution_record(passthrough_args, start_time, found_time)
+    out_dir = solution_dir(event_name, start_time)
     # Create solutions directory if it doesn't exist
     if not os.path.exists(out_dir):
         os.makedirs(out_dir)
@@ -47,9 +91,10 @@ def save_solution(passthrough_args, start_time, event_name="", file_name="soluti
                 f.write(f"{atom}.\n")
 
 
-def build_ctrl(args):
+def make_ctrl(args, arguments=()):
     # Clorm's `Control` wrapper will try to parse model facts into the predicates defined in domain.py.
     ctrl = Control(
+        list(arguments) + [f"--const={const}" for const in args.const],
         unifier=[LegCoverage, LegPaceK(args.duration_precision), Run, LegDistK(args.distance_precision), ExchangeName,
                  Leg,
                  LegDistK(args.distance_precision), LegAscent, LegDescent, Objective, LeaderOn,
@@ -60,49 +105,173 @@ def build_ctrl(args):
     if args.jobs > 1:
         ctrl.configuration.solve.parallel_mode = f"{args.jobs},split"
     ctrl.configuration.solve.opt_mode = "optN"
-    with ProgramBuilder(ctrl) as b:
-        t = FloatPaceTransformer(args.distance_precision)
-        # All ASP files in the year directory
-        year_files = glob.glob(f"{args.event}/*.lp")
-        parse_files(
-            ["scheduling-domain.lp"] + year_files,
-            lambda stm: b.add(t.visit(stm)))
     return ctrl
 
 
-def main(args):
+def program_files(args):
+    # The domain and all ASP files in the year directory
+    return ["scheduling-domain.lp"] + glob.glob(f"{args.event}/*.lp")
+
+
+def transformed_program(path, args, cache=True):
+    """
+    Parse a program file and convert its distance and duration strings to the fixed precisions in `args`. The result is
+    cached by the file's content hash, the transformer's and the precisions, so unchanged files are neither parsed nor
+    transformed again.
+    :return: The transformed program as ASP text
+    """
+    cache_path = None
+    if cache:
+        manifest = build_manifest([path, transformer.__file__], distance_precision=args.distance_precision,
+                                  duration_precision=args.duration_precision, clingo=clingo.__version__)
+        key = digest_bytes(json.dumps(manifest, sort_keys=True).encode())
+        cache_path = os.path.join(default_cache_dir(), "programs", f"{key}.lp")
+        if os.path.exists(cache_path):
+            touch(cache_path)
+            with open(cache_path) as f:
+                return f.read()
+
+    t = FloatPaceTransformer(args.distance_precision, args.duration_precision)
+    statements = []
+    parse_files([path], lambda stm: statements.append(str(t.visit(stm))))
+    program = "\n".join(statements) + "\n"
+    if cache_path:
+        write_atomically(cache_path, lambda f: f.write(program.encode()))
+        evict(os.path.dirname(cache_path), PROGRAM_CACHE_MAX_BYTES)
+    return program
+
+
+def parse_programs(args, cache=True):
+    """
+    :return: The transformed text of every program file, to add to several controls without parsing again
+    """
+    return [transformed_program(path, args, cache) for path in program_files(args)]
+
+
+def add_programs(ctrl, args, programs=None, cache=True):
+    """
+    :param programs: From `parse_programs`, if the program files have already been parsed
+    """
+    if programs is None:
+        programs = parse_programs(args, cache)
+    for program in programs:
+        # Each file starts with its own #program directive
+        ctrl.add("base", [], program)
+
+
+def build_ctrl(args):
+    ctrl = make_ctrl(args)
+    add_programs(ctrl, args)
+    return ctrl
+
+
+def ground_cache_key(args):
+    """
+    Identifies the ground program for the instance: all program files, the generated facts, the program parts that
+    get grounded, constants and the precisions. Solver options (jobs, seeds, ...) don't change the ground program.
+    """
     event = args.event
-    save_ground_model = args.save_ground_program
-    save_all_models = args.save_all_models
-    team = args.team
-    event_name = event
-    if team:
-        event_name += f"_{team}"
-    team_program = [(team, [])] if team else []
-    ctrl = build_ctrl(args)
-    additional_facts = []
+    inputs = program_files(args) + [f"{event}/facts.lpx"]
+    manifest = build_manifest(inputs, team=args.team, distance_precision=args.distance_precision,
+                              duration_precision=args.duration_precision, consts=sorted(args.const),
+                              clingo=clingo.__version__)
+    return digest_bytes(json.dumps(manifest, sort_keys=True).encode())
 
-    # You can supply a bundle of GPX legs and we'll
-    # turn them into facts. Otherwise, all the facts
-    # need to be in an .lp file in the folder.
-    if os.path.isdir(f"{event}/legs"):
-        legs_data, exchanges_data = load_from_legs_bundle(f"{event}/legs")
-        facts = legs_to_facts(legs_data, distance_precision=args.distance_precision,
-                              duration_precision=args.duration_precision)
-        additional_facts.extend(facts)
 
+def cache_ground_program(aspif_path, cache_path):
+    # Clingo only writes the ground program out once solving starts. Don't cache it if we never got that far.
+    with open(aspif_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 3))
+        complete = f.read() == b"\n0\n"
+    if complete:
+        with open(aspif_path, "rb") as src:
+            write_atomically(cache_path, lambda dst: shutil.copyfileobj(src, dst))
+        evict(os.path.dirname(cache_path), GROUND_CACHE_MAX_BYTES)
+
+
+def instance_manifest(args):
+    """
+    Inputs that facts.lpx and relay.geojson are generated from, and facts.lpx itself so that the manifest stops
+    matching if anything else writes it.
+    """
+    event = args.event
+    inputs = program_files(args) + glob.glob(f"{event}/legs/*.gpx")
+    if os.path.exists(f"{event}/facts.lpx"):
+        inputs.append(f"{event}/facts.lpx")
+    if os.path.exists(f"{event}/legs/exchanges.geojson"):
+        inputs.append(f"{event}/legs/exchanges.geojson")
+    if os.path.exists(f"{event}/{PACK_FILENAME}"):
+        inputs.append(f"{event}/{PACK_FILENAME}")
+    if args.team and os.path.exists(f"{event}/team-{args.team}.tsv"):
+        inputs.append(f"{event}/team-{args.team}.tsv")
+    return build_manifest(inputs, team=args.team, distance_precision=args.distance_precision,
+                          duration_precision=args.duration_precision, commute_matrix=args.commute_matrix,
+                          commute_radius=args.commute_radius, geojson_tolerance=args.geojson_tolerance)
+
+
+def prepare_facts(args):
+    """
+    Generate facts for the event's leg bundle and team roster and write them to facts.lpx.
+    facts.lpx and relay.geojson only depend on the inputs in `instance_manifest`. If none of them changed since the
+    last run, the facts are left for the solver to load from facts.lpx.
+    :return: (FactBase to add, or None to load facts.lpx; (legs, exchanges) if the bundle was loaded; manifest to
+        record once relay.geojson is written, or None if everything is up to date)
+    """
+    event = args.event
+    manifest_path = f"{event}/facts.manifest.json"
+    manifest = instance_manifest(args)
+    legs_path = event_legs_path(event)
+    up_to_date = (not args.regenerate and read_manifest(manifest_path) == manifest
+                  and os.path.exists(f"{event}/facts.lpx")
+                  and (legs_path is None or os.path.exists(f"{event}/relay.geojson")))
+    if up_to_date:
+        print("Inputs unchanged, reusing", f"{event}/facts.lpx")
+        return None, None, None
+
+    bundle = None
+    # You can supply a bundle of GPX legs (or a legs.pack compiled
+    # from one) and we'll turn them into facts. Otherwise, all the
+    # facts need to be in an .lp file in the folder.
+    if legs_path is not None:
+        bundle = load_legs(legs_path, workers=args.load_jobs, cache=not args.no_leg_cache)
+
+    to_add = instance_facts(args, bundle)
+    with open(f"{event}/facts.lpx", "w") as f:
+        f.writelines(to_add.asp_str(sorted=True))
+    return to_add, bundle, instance_manifest(args)
+
+
+def instance_facts(args, bundle, leg_facts=None):
+    """
+    Generate facts for the loaded leg bundle (if any) and `args.team`'s roster
+    :param leg_facts: Facts already generated from the bundle with the same options, to reuse
+    :return: FactBase
+    """
+    event = args.event
+    team = args.team
+    additional_facts = []
     # Load team participants from TSV, if the file exists.
     # Otherwise, these facts need to be in an .lp file.
+    participant_facts = []
     if team and os.path.exists(f"{event}/team-{team}.tsv"):
         participants = load_participants(pathlib.Path(f"{event}/team-{team}.tsv"))
-        # Extract the name -> ID mapping from facts so far.
-        # Get from control in case they were in .lp files
-        exchanges = clorm.unify([ExchangeName], [x.symbol for x in ctrl.symbolic_atoms.by_signature("exchangeName", 2)])
-        # Get from extra facts if came from leg bundle
-        exchanges.add(additional_facts)
-        exchanges = dict(exchanges.query(ExchangeName).select(ExchangeName.name, ExchangeName.id).all())
-        facts = participants_to_facts(participants, exchanges, args.distance_precision, args.duration_precision)
+        # The name -> ID mapping comes from the leg bundle
+        exchanges = exchange_ids(bundle[0]) if bundle else {}
+        participant_facts = participants_to_facts(participants, exchanges, args.distance_precision,
+                                                  args.duration_precision)
+
+    if leg_facts is not None:
+        additional_facts.extend(leg_facts)
+    elif bundle:
+        commute_targets = None
+        if args.commute_matrix == "preferred":
+            commute_targets = {fact.exchange_id for fact in participant_facts if isinstance(fact, PreferredEndExchange)}
+        facts = legs_to_facts(bundle[0], distance_precision=args.distance_precision,
+                              duration_precision=args.duration_precision, commute_targets=commute_targets,
+                              commute_radius=args.commute_radius)
         additional_facts.extend(facts)
+    additional_facts.extend(participant_facts)
 
     # Add precision facts so ASP can be written using the same precision
     # e.g. preferredDist("Runner", @k("10.5",P)) , distancePrecision(P).
@@ -110,65 +279,697 @@ def main(args):
         [DistancePrecision(str(args.distance_precision)),
             DurationPrecision(str(args.duration_precision))
             ])
-    to_add = FactBase(additional_facts)
-    with open(f"{event}/facts.lpx", "w") as f:
-        f.writelines(to_add.asp_str())
-    ctrl.add_facts(to_add)
+    return FactBase(additional_facts)
 
-    print("Starting grounding at", datetime.datetime.now())
-    ctrl.ground([("base", [])] + team_program, context=make_standard_func_ctx())
 
-    if save_ground_model:
-        with open("program.lpx", 'w') as f:
-            for atom in ctrl.symbolic_atoms:
-                f.write(f"{atom.symbol}.\n")
+def ground_instance(ctrl, args, to_add=None, write_cache=True, observer=None, programs=None):
+    """
+    Ground the event into `ctrl`, or load the ground program from an earlier run of the same instance.
+    :param observer: Clingo observer to register before grounding. Always grounds (rather than loading from the
+        cache) so the observer sees the program being built.
+    :param programs: From `parse_programs`, if the program files have already been parsed
+    :return: (path the ground program is being written to, cache path to copy it to once solving starts). Both are
+        None when nothing needs to be cached.
+    """
+    team_program = [(args.team, [])] if args.team else []
+    ground_cache_path = None
+    ground_program_path = None
+    if not args.no_ground_cache:
+        ground_cache_path = os.path.join(default_cache_dir(), "ground", f"{ground_cache_key(args)}.aspif")
+    if ground_cache_path and os.path.exists(ground_cache_path) and observer is None:
+        print("Loading cached ground program", ground_cache_path)
+        touch(ground_cache_path)
+        ctrl.load_aspif([ground_cache_path])
+        return None, None
 
-    # Dump out geojson representation so you can check map
-    with open(f"{event}/relay.geojson", "w") as f:
-        sequences = clorm.unify([Leg], [x.symbol for x in ctrl.symbolic_atoms.by_signature("leg", 3)])
-        sequences = {start_end: list(index) for start_end, index in sequences.query(Leg).group_by(Leg.start_id, Leg.end_id).select(Leg.id).all()}
-        dump_geojson_with_compact_geometry(relay_to_geojson(legs_data, sequences, exchanges_data), f)
+    if ground_cache_path and write_cache:
+        # Register before adding facts: clorm adds them straight through the backend
+        fd, ground_program_path = tempfile.mkstemp(suffix=".aspif")
+        os.close(fd)
+        ctrl.register_backend(BackendType.Aspif, ground_program_path)
+    try:
+        if observer is not None:
+            ctrl.register_observer(observer)
+        add_programs(ctrl, args, programs)
+        if to_add is None:
+            ctrl.load(f"{args.event}/facts.lpx")
+        else:
+            ctrl.add_facts(to_add)
+        print("Starting grounding at", datetime.datetime.now())
+        calls = collections.Counter()
+        ctrl.ground([("base", [])] + team_program, context=make_standard_func_ctx(calls))
+    except BaseException:
+        # Bad constants, syntax errors and Ctrl-C all end the run before the caller could clean up
+        if ground_program_path:
+            os.unlink(ground_program_path)
+        raise
+    if calls:
+        print("Python calls while grounding:", ", ".join(f"@{name} {count}" for name, count in calls.most_common()))
+    return ground_program_path, ground_cache_path if ground_program_path else None
 
-    solve_start_time = datetime.datetime.now()
-    print("Starting solve at", solve_start_time)
+
+def summarize_model(facts, priorities, costs, optimal, args):
+    """
+    Extract the schedule from a model's facts, in the form `save_solution` expects
+    """
+    # This hash should only be used for comparing solutions generated using the same version/dependencies. Clorm
+    # may change its string representation in the future, and the facts for a solution depend on the Python
+    # bindings for the predicates that we've specified.
+    factbase_hash = xxhash.xxh64_hexdigest(facts.asp_str(sorted=True).encode())
+    objectives_by_priority = dict(facts.query(Objective).order_by(desc(Objective.priority)).select(Objective.priority, Objective.name).all())
+    schedule, assignments = extract_schedule(facts, args.distance_precision, args.duration_precision), extract_assignments(facts, args.distance_precision, args.duration_precision)
+    return solution_summary(objectives_by_priority, priorities, costs, optimal, schedule, assignments, factbase_hash,
+                            args)
+
+
+def summarize_true_atoms(extractor, true_atoms, priorities, costs, optimal, args):
+    """
+    Like `summarize_model`, for a model snapshotted with `ModelExtractor.true_atoms`. The hash only covers the
+    schedule atoms.
+    :return: (solution, schedule atoms)
+    """
+    schedule, assignments, atoms_hash, atoms = extractor.extract(true_atoms)
+    return solution_summary(extractor.objectives_by_priority, priorities, costs, optimal, schedule, assignments,
+                            atoms_hash, args), atoms
+
+
+def solution_summary(objectives_by_priority, priorities, costs, optimal, schedule, assignments, solution_hash, args):
+    return {
+        "costs": {objectives_by_priority[priority]: cost for priority, cost in zip(priorities, costs)},
+        "distance_precision": args.distance_precision,
+        "duration_precision": args.duration_precision,
+        #"elevation_precision": args.elevation_precision,
+        "optimal": optimal,
+        "schedule": schedule,
+        "assignments": assignments,
+        "hash": solution_hash
+    }
+
+
+def warm_start_arguments(args):
+    # Domain heuristics are ignored by clingo's other heuristics
+    return ["--heuristic=Domain"] if args.warm_start or args.coarse_precision is not None else []
+
+
+def warm_start(ctrl, args):
+    """
+    Guide the solver towards a greedy schedule built from the preferences, if --warm-start is set
+    """
+    if args.warm_start:
+        segments, leader_on = greedy_schedule(ctrl.symbolic_atoms)
+        add_warm_start(ctrl, segments, leader_on, args.warm_start)
+        print(f"Warm starting from a greedy schedule ({args.warm_start} heuristics)")
+
+
+def solve_coarse(args, time_limit=None):
+    """
+    Solve the instance with distances at --coarse-precision for up to --coarse-time-limit seconds. The weights in the
+    objectives shrink accordingly, which makes the schedule quicker to optimize.
+    :param time_limit: Stop sooner than --coarse-time-limit if this many seconds (counting from the call) run out first
+    :return: The best schedule found, in the form `greedy_schedule` returns, or None
+    """
+    start = time.monotonic()
+    coarse_args = argparse.Namespace(**{**vars(args), "distance_precision": args.coarse_precision})
+    legs_path = event_legs_path(args.event)
+    bundle = None
+    if legs_path is not None:
+        bundle = load_legs(legs_path, workers=args.load_jobs, cache=not args.no_leg_cache)
+    print(f"Solving with distances to {args.coarse_precision:g} decimal places first")
+    ctrl = make_ctrl(coarse_args, warm_start_arguments(args))
+    ctrl.configuration.solve.opt_mode = "opt"
+    ground_program_path, ground_cache_path = ground_instance(ctrl, coarse_args, instance_facts(coarse_args, bundle),
+                                                             write_cache=not args.warm_start)
+    warm_start(ctrl, coarse_args)
+    choices = [atom for name in ["run", "leaderOn"] for atom in ctrl.symbolic_atoms.by_signature(name, 2)]
+    best = []
+
+    def on_model(model):
+        best[:] = [atom.symbol for atom in choices if model.is_true(atom.literal)]
+
+    limit = args.coarse_time_limit
+    if time_limit is not None:
+        limit = max(min(limit, time_limit - (time.monotonic() - start)), 0)
+    try:
+        with ctrl.solve(on_model=on_model, async_=True) as handle:
+            try:
+                if not handle.wait(limit):
+                    handle.cancel()
+                optimal = handle.get().exhausted
+            except KeyboardInterrupt:
+                print("Interrupted, moving on to full precision")
+                handle.cancel()
+                optimal = False
+    finally:
+        if ground_program_path:
+            cache_ground_program(ground_program_path, ground_cache_path)
+            os.unlink(ground_program_path)
+    if not best:
+        print("No schedule found at coarse precision")
+        return None
+    print(f"Coarse schedule{' (optimal)' if optimal else ''} after {time.monotonic() - start:.1f}s")
+    return schedule_from_atoms(best)
+
+
+def seed_from_schedule(ctrl, schedule, on_model, should_stop=lambda: False, mode="optN"):
+    """
+    Solve for the given schedule (e.g. from `solve_coarse`) alone, reporting it through `on_model`, then bound the
+    optimization by its costs so the solver only looks for schedules at least as good. The atoms the schedule doesn't
+    fix are still optimized, which can take a while, so `should_stop` is checked every second.
+    :param mode: Optimization mode to leave the solver in, bounded by the seed's costs
+    :return: The seed's costs (empty if the schedule isn't feasible), or None if the seed solve was stopped or
+             interrupted and solving shouldn't go on
+    """
+    costs = []
+
+    def on_seed(model):
+        costs[:] = model.cost
+        on_model(model)
+
+    ctrl.configuration.solve.opt_mode = "opt"
+    assumptions = [(atom.symbol, picked) for atom, picked in schedule_atoms(ctrl.symbolic_atoms, *schedule)]
+    with ctrl.solve(on_model=on_seed, assumptions=assumptions, async_=True) as handle:
+        try:
+            while not handle.wait(1):
+                if should_stop():
+                    handle.cancel()
+                    return None
+        except KeyboardInterrupt:
+            print("Interrupted, saving the models found so far")
+            handle.cancel()
+            return None
+    if not costs:
+        print("The coarse schedule isn't feasible at full precision")
+    ctrl.configuration.solve.opt_mode = mode + "".join(f",{cost}" for cost in costs)
+    return costs
+
+
+def make_extractor(ctrl, args):
+    """
+    :return: A `ModelExtractor` for the ground program in `ctrl`, or None if models should be unified in full
+    """
+    if args.full_extraction:
+        return None
+    try:
+        return ModelExtractor(ctrl.symbolic_atoms, args.distance_precision, args.duration_precision)
+    except ValueError as e:
+        print("Falling back to full extraction:", e)
+        return None
+
+
+def model_reporter(args, event_name, solve_start_time):
+    """
+    :return: (a function that prints a summarized model and saves it under the next file name, or to the run's
+        solution store; a function to call once every model has been reported, which closes the store)
+    """
     model_id = 0
     first_optimal_id = None
-    def on_model(model):
+    store = None
+
+    def report(solution, atoms, found_time=None):
         nonlocal model_id
         nonlocal first_optimal_id
-        facts = model.facts(atoms=True)
-        # This hash should only be used for comparing solutions generated using the same version/dependencies. Clorm
-        # may change its string representation in the future, and the facts for a solution depend on the Python
-        # bindings for the predicates that we've specified.
-        factbase_hash = xxhash.xxh64_hexdigest(facts.asp_str(sorted=True))
-        objectives_by_priority = dict(facts.query(Objective).order_by(desc(Objective.priority)).select(Objective.priority, Objective.name).all())
-        schedule, assignments = extract_schedule(facts, args.distance_precision, args.duration_precision), extract_assignments(facts, args.distance_precision, args.duration_precision)
-        print(assignments_to_str(assignments))
-        print(schedule_to_str(schedule))
-        costs = {objectives_by_priority[priority]: cost for priority, cost in zip(model.priority, model.cost)}
-        print(costs)
+        nonlocal store
+        arrivals = None
+        if args.simulate and solution["optimal"]:
+            offsets = simulate_start_offsets(solution["schedule"], solution["assignments"], args.simulate,
+                                             pace_sd=args.pace_sd, exchange_sd=args.exchange_sd,
+                                             exchange_overhead=EXCHANGE_OVERHEAD)
+            arrivals = arrival_percentiles(offsets)
+            solution["arrivals"] = {"percentiles": list(DEFAULT_PERCENTILES), "offsets": arrivals.tolist()}
+        if args.quiet:
+            elapsed = ((found_time or datetime.datetime.now()) - solve_start_time).total_seconds()
+            print(f"Model {model_id} after {elapsed:.1f}s{' (optimal)' if solution['optimal'] else ''}:",
+                  solution["costs"], flush=True)
+        else:
+            print(assignments_to_str(solution["assignments"]))
+            print(schedule_to_str(solution["schedule"], exchange_overhead=EXCHANGE_OVERHEAD))
+            if arrivals is not None:
+                print(arrivals_to_str(solution["schedule"], arrivals))
+            print(solution["costs"])
         file_name = "solution"
-        if save_all_models:
+        if args.save_all_models:
             file_name = f"{model_id}"
-        elif model.optimality_proven:
-            if not first_optimal_id:
+        elif solution["optimal"]:
+            if first_optimal_id is None:
                 first_optimal_id = model_id
             file_name += f"_{model_id - first_optimal_id}"
-        save_solution({
-            "costs": costs,
-            "distance_precision": args.distance_precision,
-            "duration_precision": args.duration_precision,
-            #"elevation_precision": args.elevation_precision,
-            "optimal": model.optimality_proven,
-            "schedule": schedule,
-            "assignments": assignments,
-            "hash": factbase_hash
-        },
-            solve_start_time, event_name, file_name, atoms=model.symbols(atoms=True))
-
+        if args.store == "sqlite":
+            if store is None:
+                out_dir = solution_dir(event_name, solve_start_time)
+                os.makedirs(out_dir, exist_ok=True)
+                store = SolutionStore(os.path.join(out_dir, STORE_FILENAME))
+            # Every model gets its own name: the store keeps all of them
+            store.add(solution_record(solution, solve_start_time, found_time), f"{model_id}", atoms)
+        else:
+            save_solution(solution, solve_start_time, event_name, file_name, atoms=atoms, found_time=found_time)
         model_id += 1
 
-    ctrl.solve(on_model=on_model)
+    def close():
+        if store is not None:
+            store.close()
+
+    return report, close
+
+
+def portfolio_worker(args, name, arguments, messages, write_cache):
+    """
+    Solve the instance single-threaded with one portfolio configuration, sending each model to the parent process.
+    """
+    ctrl = make_ctrl(argparse.Namespace(**{**vars(args), "jobs": 1}), arguments)
+    ground_program_path, ground_cache_path = ground_instance(ctrl, args, write_cache=write_cache)
+    extractor = make_extractor(ctrl, args)
+
+    def cache_ground_program_once():
+        nonlocal ground_program_path
+        if ground_program_path:
+            cache_ground_program(ground_program_path, ground_cache_path)
+            os.unlink(ground_program_path)
+            ground_program_path = None
+
+    def on_model(model):
+        # The ground program is complete once solving starts. Cache it now: the parent terminates this process as
+        # soon as another configuration proves optimality.
+        cache_ground_program_once()
+        if extractor is None:
+            solution = summarize_model(model.facts(atoms=True), model.priority, model.cost, model.optimality_proven,
+                                       args)
+            atoms = model.symbols(atoms=True)
+        else:
+            solution, atoms = summarize_true_atoms(extractor, extractor.true_atoms(model), model.priority, model.cost,
+                                                   model.optimality_proven, args)
+        messages.put(("model", name, list(model.cost), solution, [str(atom) for atom in atoms]))
+
+    try:
+        result = ctrl.solve(on_model=on_model)
+        messages.put(("done", name, result.exhausted))
+    finally:
+        cache_ground_program_once()
+
+
+def solve_portfolio(args, names, report):
+    """
+    Race the named `PORTFOLIO` configurations against each other in separate processes. Models are reported as long
+    as they improve on the best found by any configuration. Once one configuration proves optimality, the rest are
+    stopped and only that configuration's models are reported.
+    """
+    messages = multiprocessing.Queue()
+    # Only one worker writes the ground program for the cache; the rest would write identical copies
+    workers = {name: multiprocessing.Process(target=portfolio_worker, daemon=True,
+                                             args=(args, name, PORTFOLIO[name], messages, i == 0))
+               for i, name in enumerate(names)}
+    for worker in workers.values():
+        worker.start()
+
+    def stop_others(name):
+        for other, worker in workers.items():
+            if other != name and worker.is_alive():
+                worker.terminate()
+
+    best_cost = None
+    proven_by = None
+    running = set(names)
+    start = time.monotonic()
+    try:
+        while running:
+            if args.time_limit and time.monotonic() - start >= args.time_limit:
+                print("Time limit reached, stopping")
+                break
+            try:
+                kind, name, *payload = messages.get(timeout=1)
+            except queue.Empty:
+                for name in list(running):
+                    if not workers[name].is_alive():
+                        print(f"Configuration {name} exited with code {workers[name].exitcode}")
+                        running.discard(name)
+                continue
+            if proven_by is not None and name != proven_by:
+                continue
+            if kind == "done":
+                exhausted, = payload
+                print(f"Configuration {name} finished" + (" and proved optimality" if exhausted else ""))
+                running.discard(name)
+                if exhausted:
+                    break
+                continue
+            cost, solution, atoms = payload
+            if solution["optimal"]:
+                if proven_by is None:
+                    print(f"Configuration {name} proved optimality, stopping the others")
+                    proven_by = name
+                    stop_others(name)
+                    running = {name}
+            elif best_cost is not None and cost >= best_cost:
+                continue
+            best_cost = cost
+            report({**solution, "configuration": name}, atoms)
+    finally:
+        for worker in workers.values():
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+
+
+def solve_lns(ctrl, args, extractor, put, should_stop=lambda: False, bound=None):
+    """
+    Large neighborhood search. Solve for a first schedule, then repeatedly free either a window of consecutive legs or
+    a few runners, fix every other run/2 atom to the incumbent's value with assumptions and look for a better schedule
+    for --lns-budget seconds, bounded by the incumbent's costs. The same control is reused throughout, so the solver
+    keeps what it learned. When a neighborhood turns out to hold nothing better, the next ones are made larger.
+    Stops when interrupted, when `should_stop` returns True or when freeing everything shows the incumbent can't be
+    improved on.
+    :param put: Called with a snapshot (atoms, priorities, costs, optimal, found time) of each improvement
+    :param bound: Costs of a schedule that was already reported (e.g. by `seed_from_schedule`). The first schedule
+                  has to be at least as good.
+    """
+    runs = [(atom.symbol.arguments[0].string, atom.symbol.arguments[1].number, atom.symbol, atom.literal)
+            for atom in ctrl.symbolic_atoms.by_signature("run", 2) if not atom.is_fact]
+    legs = sorted({leg for _, leg, _, _ in runs})
+    runners = sorted({runner for runner, _, _, _ in runs})
+    rng = random.Random()
+    best_cost = list(bound) if bound else None
+    incumbent = frozenset()
+
+    def solve_neighborhood(assumptions, require_model=False):
+        """
+        :return: ([(snapshot, run atoms that are true)] of each model found, exhausted, whether to stop searching)
+        """
+        found = []
+
+        def on_model(model):
+            atoms = model.symbols(atoms=True) if extractor is None else extractor.true_atoms(model)
+            true_runs = frozenset(i for i, (_, _, _, literal) in enumerate(runs) if model.is_true(literal))
+            found.append(((atoms, model.priority, model.cost, False, datetime.datetime.now()), true_runs))
+
+        start = time.monotonic()
+        with ctrl.solve(on_model=on_model, assumptions=assumptions, async_=True) as handle:
+            try:
+                while not handle.wait(min(1.0, args.lns_budget)):
+                    if should_stop():
+                        handle.cancel()
+                        return found, False, True
+                    if time.monotonic() - start >= args.lns_budget and (found or not require_model):
+                        handle.cancel()
+                        break
+            except KeyboardInterrupt:
+                print("Interrupted, saving the models found so far")
+                handle.cancel()
+                return found, False, True
+            return found, handle.get().exhausted, False
+
+    ctrl.configuration.solve.opt_mode = "opt" + "".join(f",{cost}" for cost in best_cost or [])
+    found, exhausted, stop = solve_neighborhood([], require_model=True)
+    growth = 0
+    while True:
+        improved = False
+        for snapshot, true_runs in found:
+            costs = list(snapshot[2])
+            if best_cost is None or costs < best_cost:
+                put(snapshot)
+                improved = True
+            if best_cost is None or costs <= best_cost:
+                # Moving to schedules that are just as good lets later neighborhoods start somewhere new
+                best_cost, incumbent = costs, true_runs
+        if stop or best_cost is None:
+            return
+        if improved:
+            growth = 0
+        elif exhausted:
+            growth += 1
+
+        if rng.random() < 0.5:
+            width = min(args.lns_window + growth, len(legs))
+            first = rng.randrange(len(legs) - width + 1)
+            window = set(legs[first:first + width])
+            free = [leg in window for _, leg, _, _ in runs]
+            print(f"LNS: freeing legs {legs[first]}-{legs[first + width - 1]}", flush=True)
+        else:
+            chosen = set(rng.sample(runners, min(args.lns_runners + growth, len(runners))))
+            free = [runner in chosen for runner, _, _, _ in runs]
+            print(f"LNS: freeing {', '.join(sorted(chosen))}", flush=True)
+        assumptions = [(symbol, i in incumbent) for i, ((_, _, symbol, _), freed) in enumerate(zip(runs, free))
+                       if not freed]
+        # Only look for schedules at least as good as the incumbent
+        ctrl.configuration.solve.opt_mode = "opt," + ",".join(map(str, best_cost))
+        found, exhausted, stop = solve_neighborhood(assumptions)
+        if exhausted and not assumptions and not any(list(snapshot[2]) < best_cost for snapshot, _ in found):
+            print("LNS: no better schedule exists")
+            return
+
+
+def event_teams(event):
+    """
+    :return: Names of the teams with a roster TSV or a `#program <team>.` in a team-*.lp file, sorted
+    """
+    teams = {os.path.basename(path)[len("team-"):-len(".tsv")] for path in glob.glob(f"{event}/team-*.tsv")}
+    for path in glob.glob(f"{event}/team-*.lp"):
+        with open(path) as f:
+            for line in f:
+                if line.startswith("#program "):
+                    teams.add(line[len("#program "):].strip().rstrip("."))
+    teams.discard("base")
+    return sorted(teams)
+
+
+def team_worker(args, to_add, programs, messages):
+    """
+    Ground and solve one team's instance single-threaded, sending each model to the parent process. Forked after the
+    parent has loaded the legs and parsed the programs, so `to_add` and `programs` are inherited, not pickled.
+    """
+    ctrl = make_ctrl(args, warm_start_arguments(args))
+    ground_instance(ctrl, args, to_add, programs=programs)
+    warm_start(ctrl, args)
+    extractor = make_extractor(ctrl, args)
+
+    def on_model(model):
+        if extractor is None:
+            solution = summarize_model(model.facts(atoms=True), model.priority, model.cost, model.optimality_proven,
+                                       args)
+            atoms = model.symbols(atoms=True)
+        else:
+            solution, atoms = summarize_true_atoms(extractor, extractor.true_atoms(model), model.priority, model.cost,
+                                                   model.optimality_proven, args)
+        messages.put(("model", args.team, solution, [str(atom) for atom in atoms]))
+
+    result = ctrl.solve(on_model=on_model)
+    messages.put(("done", args.team, result.exhausted))
+
+
+def solve_teams(args, teams):
+    """
+    Solve several teams of the event at once, one process per team. The legs are loaded and the programs parsed
+    once, before the workers are forked. Each team's ground program depends on its roster, so each worker grounds its
+    own. Each team's models are saved like a `--team` run's, and a summary of every team is written at the end.
+    """
+    event = args.event
+    legs_path = event_legs_path(event)
+    bundle = None
+    if legs_path is not None:
+        bundle = load_legs(legs_path, workers=args.load_jobs, cache=not args.no_leg_cache)
+    leg_facts = None
+    if bundle and args.commute_matrix == "full":
+        # Only the roster differs between teams
+        leg_facts = legs_to_facts(bundle[0], distance_precision=args.distance_precision,
+                                  duration_precision=args.duration_precision, commute_radius=args.commute_radius)
+    programs = parse_programs(args)
+
+    solve_start_time = datetime.datetime.now()
+    print("Starting solve at", solve_start_time, "for teams", ", ".join(teams))
+    # facts.lpx holds a single team's facts, so it isn't written here and the ground cache can't be keyed by it
+    team_args = {team: argparse.Namespace(**{**vars(args), "team": team, "jobs": 1, "no_ground_cache": True})
+                 for team in teams}
+    reporters = {team: model_reporter(team_args[team], f"{event}_{team}", solve_start_time) for team in teams}
+    summary = {team: {"models": 0, "costs": None, "optimal": False, "finished": False,
+                      "solutions": solution_dir(f"{event}_{team}", solve_start_time)} for team in teams}
+
+    context = multiprocessing.get_context("fork")
+    messages = context.Queue()
+    pending = list(teams)
+    workers = {}
+    max_workers = args.team_workers or len(teams)
+    start = time.monotonic()
+    try:
+        while pending or workers:
+            if args.time_limit and time.monotonic() - start >= args.time_limit:
+                print("Time limit reached, stopping")
+                break
+            while pending and len(workers) < max_workers:
+                team = pending.pop(0)
+                to_add = instance_facts(team_args[team], bundle, leg_facts)
+                workers[team] = context.Process(target=team_worker, daemon=True,
+                                                args=(team_args[team], to_add, programs, messages))
+                workers[team].start()
+            try:
+                kind, team, *payload = messages.get(timeout=1)
+            except queue.Empty:
+                for team, worker in list(workers.items()):
+                    if not worker.is_alive():
+                        print(f"Team {team} exited with code {worker.exitcode}")
+                        del workers[team]
+                continue
+            if kind == "done":
+                exhausted, = payload
+                print(f"Team {team} finished" + (" and proved optimality" if exhausted else ""))
+                summary[team]["finished"] = True
+                workers.pop(team).join()
+                continue
+            solution, atoms = payload
+            report, _ = reporters[team]
+            report({**solution, "team": team}, atoms)
+            summary[team].update(models=summary[team]["models"] + 1, costs=solution["costs"],
+                                 optimal=solution["optimal"], hash=solution["hash"])
+    except KeyboardInterrupt:
+        print("Interrupted, saving the models found so far")
+    finally:
+        for worker in workers.values():
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        for _, close_reporter in reporters.values():
+            close_reporter()
+
+    out_dir = solution_dir(event, solve_start_time)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(f"{out_dir}/teams.json", "w") as f:
+        json.dump({"startTime": solve_start_time.isoformat(), "teams": summary}, f, indent=2)
+    print(tabulate([[team, s["models"], s["optimal"], s["finished"], s["costs"]] for team, s in summary.items()],
+                   headers=["Team", "Models", "Optimal", "Finished", "Costs"]))
+    print("Summary written to", f"{out_dir}/teams.json")
+    print("Finished solve at", datetime.datetime.now())
+    print("Elapsed time:", datetime.datetime.now() - solve_start_time)
+
+
+def main(args):
+    event = args.event
+    if args.teams is not None:
+        solve_teams(args, args.teams or event_teams(event))
+        return
+    event_name = event
+    if args.team:
+        event_name += f"_{args.team}"
+
+    to_add, bundle, manifest = prepare_facts(args)
+
+    if args.portfolio is not None:
+        names = args.portfolio or list(PORTFOLIO)
+        solve_start_time = datetime.datetime.now()
+        print("Starting portfolio solve at", solve_start_time, "with", ", ".join(names))
+        report, close_reporter = model_reporter(args, event_name, solve_start_time)
+        try:
+            solve_portfolio(args, names, report)
+        finally:
+            close_reporter()
+        # relay.geojson is written from the ground program, which only the workers have. Leave the manifest alone so
+        # the next regular run writes it.
+        print("Finished solve at", datetime.datetime.now())
+        print("Elapsed time:", datetime.datetime.now() - solve_start_time)
+        return
+
+    # With --coarse-precision, the time limit also covers the coarse solve
+    limit_start_time = datetime.datetime.now()
+    coarse_schedule = solve_coarse(args, args.time_limit) if args.coarse_precision is not None else None
+    ctrl = make_ctrl(args, warm_start_arguments(args)
+                     + ([f"--opt-strategy={args.opt_strategy}"] if args.opt_strategy else []))
+    profiler = GroundProfiler() if args.ground_profile else None
+    # The warm start's heuristics are added through the backend, so they'd end up in the cached ground program. So would
+    # every LNS step's assumptions.
+    ground_program_path, ground_cache_path = ground_instance(
+        ctrl, args, to_add, write_cache=not (args.warm_start or args.lns or args.coarse_precision is not None),
+        observer=profiler)
+    if coarse_schedule is not None:
+        add_warm_start(ctrl, *coarse_schedule)
+    else:
+        warm_start(ctrl, args)
+
+    if profiler is not None:
+        objectives = clorm.unify([Objective], [x.symbol for x in ctrl.symbolic_atoms.by_signature("objective", 2)])
+        report = build_report(profiler, program_files(args),
+                              dict(objectives.query(Objective).select(Objective.priority, Objective.name).all()))
+        with open(args.ground_profile, "w") as f:
+            json.dump(report, f, indent=2)
+        print(report_to_str(report))
+        print("Ground profile written to", args.ground_profile)
+
+    if args.save_ground_program:
+        with open("program.lpx", 'w') as f:
+            for atom in ctrl.symbolic_atoms:
+                f.write(f"{atom.symbol}.\n")
+
+    if manifest is not None:
+        if bundle is not None:
+            legs_data, exchanges_data = bundle
+            # Dump out geojson representation so you can check map
+            with open(f"{event}/relay.geojson", "w") as f:
+                sequences = clorm.unify([Leg], [x.symbol for x in ctrl.symbolic_atoms.by_signature("leg", 3)])
+                sequences = {start_end: list(index) for start_end, index in sequences.query(Leg).group_by(Leg.start_id, Leg.end_id).select(Leg.id).all()}
+                write_geojson_features(iter_relay_features(legs_data, sequences, exchanges_data,
+                                                           tolerance=args.geojson_tolerance), f)
+        write_manifest(f"{event}/facts.manifest.json", manifest)
+
+    solve_start_time = datetime.datetime.now()
+    if args.coarse_precision is None:
+        limit_start_time = solve_start_time
+    print("Starting solve at", solve_start_time)
+    report, close_reporter = model_reporter(args, event_name, solve_start_time)
+    extractor = make_extractor(ctrl, args)
+    out_dir = solution_dir(event_name, solve_start_time)
+    os.makedirs(out_dir, exist_ok=True)
+    trace = ConvergenceTrace(os.path.join(out_dir, TRACE_FILENAME), solve_start_time)
+
+    def write(snapshot):
+        atoms, priorities, costs, optimal, found_time = snapshot
+        if extractor is None:
+            solution = summarize_model(ctrl.unifier.unify(atoms), priorities, costs, optimal, args)
+        else:
+            solution, atoms = summarize_true_atoms(extractor, atoms, priorities, costs, optimal, args)
+        report(solution, atoms, found_time)
+        trace.model(solution["costs"], found_time)
+
+    def should_stop():
+        if args.time_limit and (datetime.datetime.now() - limit_start_time).total_seconds() >= args.time_limit:
+            print("Time limit reached, stopping")
+            return True
+        if args.stop_at_gap is not None and trace.gap is not None and trace.gap <= args.stop_at_gap:
+            print(f"Optimality gap {trace.gap:.4g} reached, stopping")
+            return True
+        return False
+
+    # The solver waits for on_model to return, so only take a snapshot here. Extraction, printing and saving happen
+    # on the writer's thread.
+    try:
+        with BackgroundWriter(write, args.writer_queue) as writer:
+            def on_model(model):
+                atoms = model.symbols(atoms=True) if extractor is None else extractor.true_atoms(model)
+                writer.put((atoms, model.priority, model.cost, model.optimality_proven, datetime.datetime.now()))
+
+            try:
+                seed = [] if coarse_schedule is None else seed_from_schedule(ctrl, coarse_schedule, on_model,
+                                                                               should_stop)
+                if seed is not None and args.lns:
+                    solve_lns(ctrl, args, extractor, writer.put, should_stop, seed)
+                elif seed is not None:
+                    # Solve in the background and wait with a timeout so Ctrl-C reaches Python. The solver used to be
+                    # interrupted through the exception raised in on_model, which no longer holds it up long enough.
+                    with ctrl.solve(on_model=on_model,
+                                    on_unsat=lambda lower: trace.bound(lower, datetime.datetime.now()),
+                                    async_=True) as handle:
+                        try:
+                            while not handle.wait(1):
+                                if should_stop():
+                                    handle.cancel()
+                                    break
+                        except KeyboardInterrupt:
+                            print("Interrupted, saving the models found so far")
+                            handle.cancel()
+            finally:
+                if ground_program_path:
+                    cache_ground_program(ground_program_path, ground_cache_path)
+                    os.unlink(ground_program_path)
+    finally:
+        # The writer has drained by now
+        close_reporter()
+    trace.finish(ctrl.statistics, datetime.datetime.now())
+    trace.close()
+    print("Convergence trace written to", os.path.join(out_dir, TRACE_FILENAME))
     print("Finished solve at", datetime.datetime.now())
     print("Elapsed time:", datetime.datetime.now() - solve_start_time)
 
@@ -180,11 +981,49 @@ if __name__ == "__main__":
     parser.add_argument("event", choices=subdirs, help="Path to directory containing relay domain .lp files")
     parser.add_argument("--save-all-models", action="store_true", help="Save all (even non-optimal) models found while solving")
     parser.add_argument("--team", default=None, type=str, help="Include a file named 'team-<TEAM>.lp' and ignore all other .lp files beginning with 'team'. Useful for scheduling separate groups.")
+    parser.add_argument("--teams", nargs="*", metavar="TEAM", help="Solve several teams of the event at once, each in its own single-threaded process (default: every team with a team-<TEAM>.tsv or a #program in a team-*.lp file). Legs are loaded and programs parsed once for all of them. Ignores --jobs and the ground cache.")
+    parser.add_argument("--team-workers", type=int, metavar="N", help="Solve at most N teams at a time with --teams (default: all of them)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Print one progress line with the costs for each model instead of the schedule tables. Models are still saved.")
+    parser.add_argument("--store", choices=["files", "sqlite"], default="files", help="Save each model as JSON, CSV and .lp files, or record every model (once per hash, with compressed atoms) in a single 'solutions.sqlite' in the run's folder. Query it with print_schedule.py.")
+    parser.add_argument("--simulate", type=int, default=0, metavar="RACES", help="Simulate this many races for each optimal model and report the percentiles of when the team reaches each exchange")
+    parser.add_argument("--pace-sd", type=float, default=0.04, help="Spread of each runner's pace on the day in simulated races, as the standard deviation of its log")
+    parser.add_argument("--exchange-sd", type=float, default=0.5, help="Coefficient of variation of the exchange overhead in simulated races")
+    parser.add_argument("--writer-queue", type=int, default=16, help="Number of models that can wait to be saved before the solver pauses for the writer to catch up.")
+    parser.add_argument("--full-extraction", action="store_true", help="Unify every atom of each model with clorm, hash all of them and save them to the model's .lp file. By default, only the run/2, leaderOn/2 and legPace/2 atoms are read from models.")
     parser.add_argument("--save-ground-program", action="store_true", help="Store the ground program to 'program.lp'. Use to debug lengthy ground-times, and to see which rules cause your domain to grow")
+    parser.add_argument("--ground-profile", nargs="?", const="ground-profile.json", metavar="PATH", help="Break the ground program down by predicate and the rules that define it. Prints a table and writes JSON to PATH (default: 'ground-profile.json'). Always grounds instead of using the ground cache.")
     parser.add_argument("--distance-precision", default=2.0, type=float, help="Number of decimal places of fixed precision to convert distance terms to")
     # Not implemented yet. Consider implementing if using elevation/duration optimization criteria heavily and programs are too big.
     #parser.add_argument("--elevation-precision", default=0.0, type=float, help="Number of decimal places of fixed precision to convert elevation terms to")
     parser.add_argument("--duration-precision", default=0.0, type=float, help="Number of decimal places of fixed precision to convert distance terms to")
+    parser.add_argument("--commute-matrix", choices=["full", "preferred"], default="full", help="Generate commute distances between every pair of exchanges, or only to and from the preferred end exchanges in the team's TSV. Use 'preferred' when no program declares other preferredEndExchange/2 facts.")
+    parser.add_argument("--commute-radius", type=float, metavar="MILES", help="Count commutes longer than this as exactly this long, so the commute-pref objective doesn't trade off one far-off end exchange against another.")
+    parser.add_argument("--geojson-tolerance", type=float, metavar="METERS", help="Simplify the leg tracks in relay.geojson to within this many meters of the GPX tracks. Keeps every point by default.")
+    parser.add_argument("-c", "--const", action="append", default=[], metavar="NAME=VALUE", help="Override a #const in the programs, e.g. '-c range_encoding=compact'. Can be repeated.")
     parser.add_argument("-j", "--jobs", type=int, default=4, help="Number of cores to use for solving.")
+    parser.add_argument("--load-jobs", type=int, default=1, help="Number of processes to use for parsing GPX legs.")
+    parser.add_argument("--no-leg-cache", action="store_true", help="Parse every GPX leg instead of reusing the shared cache of parsed legs.")
+    parser.add_argument("--no-ground-cache", action="store_true", help="Always ground the program instead of reusing a cached ground program for the same instance.")
+    parser.add_argument("--regenerate", action="store_true", help="Rebuild facts.lpx and relay.geojson even if their inputs haven't changed.")
+    parser.add_argument("--time-limit", type=float, metavar="SECONDS", help="Stop solving after this long and keep the best models found so far")
+    parser.add_argument("--stop-at-gap", type=float, metavar="GAP", help="Stop once the best model's cost is within this fraction of the lower bound, at the most important objective where they differ (0 stops at the first model proven optimal). Lower bounds are only found by core-guided strategies, e.g. '--opt-strategy usc'. Not available with --portfolio or --teams.")
+    parser.add_argument("--opt-strategy", metavar="STRATEGY", help="Clingo optimization strategy, e.g. 'bb,lin' (clingo's default) or 'usc,oll'. Not available with --portfolio or --teams.")
+    parser.add_argument("--warm-start", nargs="?", const="sign", choices=["sign", "level"], help="Build a schedule greedily from the runners' preferences and steer the solver towards it with domain heuristics. 'sign' (the default) only makes the solver try that schedule's assignments first; 'level' also makes it decide them before anything else. Doesn't write the ground cache. Can't be combined with --portfolio.")
+    parser.add_argument("--coarse-precision", type=float, metavar="DECIMALS", help="First solve with distances to this many decimal places (e.g. 1), then start the full precision solve from the best schedule found, bounded by its costs. Doesn't write the ground cache. Can't be combined with --portfolio or --teams.")
+    parser.add_argument("--coarse-time-limit", type=float, default=30, metavar="SECONDS", help="Time to spend on the coarse solve with --coarse-precision")
+    parser.add_argument("--lns", action="store_true", help="Improve on the first schedule found with large neighborhood search until interrupted: repeatedly re-solve a window of legs or a few runners with the rest of the schedule fixed. Only improvements are saved. Doesn't write the ground cache. Can't be combined with --portfolio or --teams.")
+    parser.add_argument("--lns-budget", type=float, default=5, metavar="SECONDS", help="Time to spend on the first schedule and on each neighborhood with --lns")
+    parser.add_argument("--lns-window", type=int, default=5, metavar="LEGS", help="Number of consecutive legs to free in a leg neighborhood with --lns")
+    parser.add_argument("--lns-runners", type=int, default=3, metavar="N", help="Number of runners to free in a runner neighborhood with --lns")
+    parser.add_argument("--portfolio", nargs="*", choices=sorted(PORTFOLIO), metavar="CONFIG", help=f"Race solver configurations in separate single-threaded processes and keep the best model from any of them. Choose from {', '.join(PORTFOLIO)} (default: all). Ignores --jobs.")
     args = parser.parse_args()
+    if args.teams is not None and (args.team or args.portfolio is not None):
+        parser.error("--teams can't be combined with --team or --portfolio")
+    if (args.teams is not None or args.portfolio is not None) and (args.opt_strategy or args.stop_at_gap is not None):
+        # Portfolio configurations bring their own strategies, and neither mode writes a convergence trace
+        parser.error("--opt-strategy and --stop-at-gap can't be combined with --teams or --portfolio")
+    if (args.teams is not None or args.portfolio is not None) and (args.lns or args.coarse_precision is not None):
+        parser.error("--lns and --coarse-precision can't be combined with --teams or --portfolio")
+    if args.portfolio is not None and args.warm_start:
+        parser.error("--warm-start can't be combined with --portfolio")
     main(args)
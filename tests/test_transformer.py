@@ -0,0 +1,31 @@
+from collections import Counter
+
+import clingo
+from clingo.ast import parse_string
+
+from relay_scheduler.domain import make_standard_func_ctx
+from relay_scheduler.transformer import FloatPaceTransformer
+
+# Each call is written twice: once with constant arguments, which the transformer folds, and once with the precision
+# bound while grounding, which leaves the call to clingo
+PROGRAM = """
+folded(k, @k(1050, "2")).
+runtime(k, @k(1050, P)) :- precision(P).
+folded(duration, @duration("8:00", "2")).
+runtime(duration, @duration("8:00", P)) :- precision(P).
+"""
+# Added like instance facts, without going through the transformer
+FACTS = 'precision("2").'
+
+
+def test_folded_and_runtime_calls_agree():
+    t = FloatPaceTransformer()
+    statements = []
+    parse_string(PROGRAM, lambda stm: statements.append(str(t.visit(stm))))
+    calls = Counter()
+    ctrl = clingo.Control()
+    ctrl.add("base", [], "\n".join(statements) + FACTS)
+    ctrl.ground([("base", [])], context=make_standard_func_ctx(calls))
+    atoms = {str(atom.symbol) for atom in ctrl.symbolic_atoms}
+    assert calls == {"k": 1, "duration": 1}
+    assert {"folded(k,105000)", "runtime(k,105000)", "folded(duration,48000)", "runtime(duration,48000)"} <= atoms
@@ -0,0 +1,52 @@
+import clingo
+
+from relay_scheduler.whatif import WhatIf, externals_program
+
+RUNNERS = ["Ann", "Bob"]
+# Stands in for schedule extraction, which needs every runner with a preference to be a participant
+PROGRAM = """
+orphan(P) :- preferredEndExchange(P, _), not participant(P).
+orphan(P) :- preferredDistance(P, _), not participant(P).
+orphan(P) :- willingToLead(P), not participant(P).
+orphan(P) :- pinned(P, _), not participant(P).
+"""
+
+
+def make_session():
+    initial = [clingo.parse_term(term) for name in RUNNERS for term in
+               [f'participant("{name}")', f'preferredDistance("{name}",500)', f'preferredEndExchange("{name}",3)',
+                f'willingToLead("{name}")']]
+    externals = initial + [clingo.parse_term(f'pinned("{name}",1)') for name in RUNNERS]
+    ctrl = clingo.Control()
+    ctrl.add("base", [], PROGRAM + externals_program(externals))
+    ctrl.ground([("base", [])])
+    return WhatIf(ctrl, externals, initial, 2.0)
+
+
+def solve(session):
+    session.apply()
+    with session.ctrl.solve(yield_=True) as handle:
+        return {str(symbol) for symbol in next(iter(handle)).symbols(atoms=True)}
+
+
+def test_drop_releases_all_of_a_runners_atoms():
+    session = make_session()
+    session.pin("Ann", 1)
+    session.set_participating("Ann", False)
+    atoms = solve(session)
+    assert not any(atom.startswith("orphan") for atom in atoms)
+    assert 'participant("Bob")' in atoms and not any('"Ann"' in atom for atom in atoms)
+
+
+def test_restore_brings_back_preferences_changed_while_dropped():
+    session = make_session()
+    session.pin("Ann", 1)
+    session.set_participating("Ann", False)
+    session.set_end_exchange("Ann", None)
+    session.set_participating("Ann", True)
+    atoms = solve(session)
+    assert {'participant("Ann")', 'preferredDistance("Ann",500)', 'willingToLead("Ann")',
+            'pinned("Ann",1)'} <= atoms
+    assert 'preferredEndExchange("Ann",3)' not in atoms
+    assert session.changes() == ([clingo.parse_term('pinned("Ann",1)')],
+                                 [clingo.parse_term('preferredEndExchange("Ann",3)')])
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+Answer what-if questions about a team's schedule without regrounding.
+
+The event is ground once with roster membership, preferred distances, preferred end exchanges, leader willingness
+and leg pins declared as externals. Each query then flips externals and re-solves on the same Control. Commands are
+read one per line from stdin:
+
+    distance "Name" MILES        end "Name" EXCHANGE|none     lead "Name" yes|no
+    drop "Name"                  restore "Name"
+    pin "Name" LEG               unpin "Name" LEG
+    changes                      reset                        solve                        quit
+"""
+
+import argparse
+import glob
+import math
+import os
+import pathlib
+import shlex
+import sys
+import time
+
+from clorm import FactBase, desc
+
+from relay_scheduler.domain import ExchangeName, DistancePrecision, DurationPrecision, Objective, \
+    make_standard_func_ctx
+from relay_scheduler.legpack import event_legs_path, load_legs
+from relay_scheduler.legs import legs_to_facts
+from relay_scheduler.participants import load_participants, participants_to_facts
+from relay_scheduler.schedule import extract_schedule, extract_assignments, assignments_to_str, schedule_to_str
+from relay_scheduler.whatif import WHATIF_PROGRAM, WhatIf, participant_externals, externals_program
+from solve import make_ctrl, add_programs
+
+
+def build_session(args):
+    event, team = args.event, args.team
+    participants_file = pathlib.Path(f"{event}/team-{team}.tsv")
+    legs_path = event_legs_path(event)
+    if legs_path is None or not participants_file.exists():
+        raise SystemExit(f"What-if mode needs a legs bundle and {participants_file}")
+
+    legs_data, _ = load_legs(legs_path, workers=args.load_jobs, cache=not args.no_leg_cache)
+    leg_facts = legs_to_facts(legs_data, distance_precision=args.distance_precision,
+                              duration_precision=args.duration_precision)
+    exchanges = {fact.name: fact.id for fact in leg_facts if isinstance(fact, ExchangeName)}
+    participants = load_participants(participants_file)
+    participant_facts = participants_to_facts(participants, exchanges, args.distance_precision,
+                                              args.duration_precision)
+    distance_choices = args.distance_choices
+    if not distance_choices:
+        distance_choices = range(1, math.ceil(max(p["distance"] for p in participants)) + 1)
+    externals, initial, fixed = participant_externals(participant_facts, exchanges.values(), distance_choices,
+                                                      args.distance_precision)
+
+    ctrl = make_ctrl(args)
+    # We want the best schedule for each question, not every optimal one
+    ctrl.configuration.solve.opt_mode = "opt"
+    add_programs(ctrl, args)
+    ctrl.add("whatif", [], WHATIF_PROGRAM + externals_program(externals))
+    ctrl.add_facts(FactBase(leg_facts + fixed + [DistancePrecision(str(args.distance_precision)),
+                                                 DurationPrecision(str(args.duration_precision))]))
+    print("Starting grounding at", time.strftime("%X"))
+    ctrl.ground([("base", []), (team, []), ("whatif", [])], context=make_standard_func_ctx())
+    return WhatIf(ctrl, externals, initial, args.distance_precision), exchanges
+
+
+def solve(session, args):
+    session.apply()
+    best = None
+
+    def on_model(model):
+        nonlocal best
+        best = (model.symbols(atoms=True), model.priority, model.cost, model.optimality_proven)
+
+    start = time.time()
+    with session.ctrl.solve(on_model=on_model, async_=True) as handle:
+        finished = handle.wait(args.time_limit)
+        if not finished:
+            handle.cancel()
+        result = handle.get()
+    elapsed = time.time() - start
+
+    if best is None:
+        print("No schedule found" + (" (unsatisfiable)" if result.unsatisfiable else f" within {args.time_limit}s"))
+        return
+    symbols, priorities, costs, optimal = best
+    facts = session.ctrl.unifier.unify(symbols)
+    objectives_by_priority = dict(facts.query(Objective).order_by(desc(Objective.priority))
+                                  .select(Objective.priority, Objective.name).all())
+    print(assignments_to_str(extract_assignments(facts, args.distance_precision, args.duration_precision)))
+    print(schedule_to_str(extract_schedule(facts, args.distance_precision, args.duration_precision)))
+    print({objectives_by_priority[priority]: cost for priority, cost in zip(priorities, costs)})
+    print(f"{'Optimal' if optimal or result.exhausted else 'Best found'} after {elapsed:.1f}s")
+
+
+def run_command(session, exchanges, words, args):
+    command, params = words[0], words[1:]
+    if command == "distance":
+        session.set_distance(params[0], float(params[1]))
+    elif command == "end":
+        if params[1].lower() == "none":
+            session.set_end_exchange(params[0], None)
+        elif params[1] in exchanges:
+            session.set_end_exchange(params[0], exchanges[params[1]])
+        else:
+            session.set_end_exchange(params[0], int(params[1]))
+    elif command == "lead":
+        session.set_leader(params[0], params[1].lower() in ("yes", "true"))
+    elif command in ("drop", "restore"):
+        session.set_participating(params[0], command == "restore")
+    elif command in ("pin", "unpin"):
+        session.pin(params[0], int(params[1]), pinned=command == "pin")
+    elif command == "changes":
+        added, removed = session.changes()
+        print("On:", ", ".join(map(str, added)) or "-")
+        print("Off:", ", ".join(map(str, removed)) or "-")
+    elif command == "reset":
+        session.reset()
+    elif command == "solve":
+        solve(session, args)
+    else:
+        raise ValueError(f"Unknown command {command}")
+
+
+def main(args):
+    session, exchanges = build_session(args)
+    interactive = sys.stdin.isatty()
+    while True:
+        if interactive:
+            print("> ", end="", flush=True)
+        line = sys.stdin.readline()
+        if not line:
+            break
+        words = shlex.split(line, comments=True)
+        if not words:
+            continue
+        if words[0] == "quit":
+            break
+        try:
+            run_command(session, exchanges, words, args)
+        except (ValueError, IndexError) as e:
+            print("Error:", e)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    asp_subdir_paths = glob.glob("*/*.lp")
+    subdirs = set([str(pathlib.Path(p).parent) for p in asp_subdir_paths])
+    parser.add_argument("event", choices=subdirs, help="Path to directory containing relay domain .lp files")
+    parser.add_argument("--team", required=True, type=str, help="Team program to ground. Participants are read from 'team-<TEAM>.tsv'.")
+    parser.add_argument("--distance-choices", nargs="+", type=float, metavar="MILES", help="Preferred distances queries may switch to. Defaults to every whole mile up to the longest preferred distance.")
+    parser.add_argument("--time-limit", type=float, default=10, help="Seconds to spend on each query before reporting the best schedule found.")
+    parser.add_argument("--distance-precision", default=2.0, type=float, help="Number of decimal places of fixed precision to convert distance terms to")
+    parser.add_argument("--duration-precision", default=0.0, type=float, help="Number of decimal places of fixed precision to convert distance terms to")
+    parser.add_argument("-c", "--const", action="append", default=[], metavar="NAME=VALUE", help="Override a #const in the programs, e.g. '-c range_encoding=compact'. Can be repeated.")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="Number of cores to use for solving.")
+    parser.add_argument("--load-jobs", type=int, default=1, help="Number of processes to use for parsing GPX legs.")
+    parser.add_argument("--no-leg-cache", action="store_true", help="Parse every GPX leg instead of reusing the shared cache of parsed legs.")
+    args = parser.parse_args()
+    main(args)